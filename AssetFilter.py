@@ -0,0 +1,58 @@
+from fnmatch import fnmatchcase
+from typing import Iterable, Optional
+
+
+def _patterns(patterns: Optional[Iterable[str]]):
+    return tuple(pattern.lower() for pattern in patterns or ())
+
+
+def _matches(value: str, patterns) -> bool:
+    value = value.lower()
+    return any(fnmatchcase(value, pattern) for pattern in patterns)
+
+
+class AssetFilter:
+    """
+    Include/exclude rules for assets, by kind ('texture', 'mesh', ...), chunk name glob and name glob.
+    Globs are case insensitive. An empty include list keeps everything, excludes win over includes.
+    """
+
+    def __init__(self, kinds: Optional[Iterable[str]] = None, exclude_kinds: Optional[Iterable[str]] = None,
+                 chunk_names: Optional[Iterable[str]] = None, exclude_chunk_names: Optional[Iterable[str]] = None,
+                 names: Optional[Iterable[str]] = None, exclude_names: Optional[Iterable[str]] = None):
+        self.kinds = frozenset(kinds or ())
+        self.exclude_kinds = frozenset(exclude_kinds or ())
+        self.chunk_names = _patterns(chunk_names)
+        self.exclude_chunk_names = _patterns(exclude_chunk_names)
+        self.names = _patterns(names)
+        self.exclude_names = _patterns(exclude_names)
+
+    def __repr__(self):
+        return '<AssetFilter {}>'.format(self.to_json())
+
+    def __bool__(self):
+        return any(self.to_json().values())
+
+    @property
+    def needs_names(self):
+        """Whether match depends on the chunk name or name, which are only known after reading the asset header"""
+        return bool(self.chunk_names or self.exclude_chunk_names or self.names or self.exclude_names)
+
+    def match_kind(self, kind: str) -> bool:
+        return (not self.kinds or kind in self.kinds) and kind not in self.exclude_kinds
+
+    def match(self, kind: str, chunk_name='', name='') -> bool:
+        if not self.match_kind(kind):
+            return False
+        if self.chunk_names and not _matches(chunk_name, self.chunk_names):
+            return False
+        if self.names and not _matches(name, self.names):
+            return False
+        return not (_matches(chunk_name, self.exclude_chunk_names) or _matches(name, self.exclude_names))
+
+    def to_json(self):
+        return {
+            'kinds': sorted(self.kinds), 'exclude_kinds': sorted(self.exclude_kinds),
+            'chunk_names': list(self.chunk_names), 'exclude_chunk_names': list(self.exclude_chunk_names),
+            'names': list(self.names), 'exclude_names': list(self.exclude_names),
+        }
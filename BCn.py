@@ -0,0 +1,148 @@
+import struct
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# texture format id -> (PIL bcn decoder number, bytes per 4x4 block, DDS fourcc)
+BCN_FORMATS = {
+    7: (1, 8, b'DXT1'),
+    9: (2, 16, b'DXT3'),
+    11: (3, 16, b'DXT5'),
+    # 5: (7, 16, ...),
+}
+
+DDS_MAGIC = b'DDS '
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+
+
+def level_size(width: int, height: int, block_size: int) -> int:
+    """Bytes of one BCn compressed image, partial blocks are padded to whole 4x4 blocks"""
+    return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+
+
+def dds_header(width: int, height: int, fourcc: bytes, linear_size: int, mip_count=1) -> bytes:
+    """'DDS ' magic and the 124 byte DDS_HEADER of a block compressed 2D texture"""
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    caps = DDSCAPS_TEXTURE
+    if mip_count > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+    header = struct.pack('<7I44x', 124, flags, height, width, linear_size, 0, mip_count)
+    pixel_format = struct.pack('<2I4s5I', 32, DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0)
+    return DDS_MAGIC + header + pixel_format + struct.pack('<5I', caps, 0, 0, 0, 0)
+
+
+def _unpack_565(color: np.ndarray) -> np.ndarray:
+    """uint16 565 colors -> (..., 3) channels expanded to 8 bits by bit replication"""
+    r = (color & 0xf800) >> 8
+    g = (color & 0x07e0) >> 3
+    b = (color & 0x001f) << 3
+    return np.stack((r | r >> 5, g | g >> 6, b | b >> 5), -1)
+
+
+def _gather(palette: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """palette[block, indices[block, pixel]] for (N, K) palettes and (N, 16) indices"""
+    indices = indices.astype(np.intp)
+    indices += np.arange(0, palette.size, palette.shape[1], dtype=np.intp)[:, None]
+    return palette.ravel().take(indices)
+
+
+def _decode_colors(blocks: np.ndarray, four_color: bool) -> np.ndarray:
+    """(N, 8) BC1 color blocks -> (N, 16, 4) uint8, three color blocks (c0 <= c1) have transparent black at index 3"""
+    words = np.ascontiguousarray(blocks).view('<u2')
+    c0 = words[:, 0]
+    c1 = words[:, 1]
+    rgb0 = _unpack_565(c0)
+    rgb1 = _unpack_565(c1)
+    palette = np.empty((len(blocks), 4, 4), np.uint8)
+    palette[:, :, 3] = 255
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    palette[:, 2, :3] = (2 * rgb0 + rgb1) // 3
+    palette[:, 3, :3] = (rgb0 + 2 * rgb1) // 3
+    if not four_color:
+        three = (c0 <= c1)[:, None]
+        palette[:, 2, :3] = np.where(three, (rgb0 + rgb1) // 2, palette[:, 2, :3])
+        palette[:, 3] = np.where(three, 0, palette[:, 3])
+    lut = words[:, 2].astype(np.uint32) | words[:, 3].astype(np.uint32) << 16
+    indices = (lut[:, None] >> np.arange(0, 32, 2, dtype=np.uint32)) & 3
+    return _gather(palette.view(np.uint32)[:, :, 0], indices).view(np.uint8).reshape(len(blocks), 16, 4)
+
+
+def _decode_bc2_alpha(blocks: np.ndarray) -> np.ndarray:
+    """(N, 8) explicit 4 bit alpha -> (N, 16)"""
+    nibbles = np.stack((blocks & 0xf, blocks >> 4), -1).reshape(len(blocks), 16)
+    return nibbles << 4 | nibbles
+
+
+def _decode_bc3_alpha(blocks: np.ndarray) -> np.ndarray:
+    """(N, 8) interpolated alpha -> (N, 16)"""
+    a0 = blocks[:, 0].astype(np.uint16)[:, None]
+    a1 = blocks[:, 1].astype(np.uint16)[:, None]
+    weights = np.arange(6, 0, -1, dtype=np.uint16)
+    eight = (weights * a0 + (7 - weights) * a1) // 7
+    six = (weights[2:] * a0 + (5 - weights[2:]) * a1) // 5
+    palette = np.empty((len(blocks), 8), np.uint8)
+    palette[:, 0:1] = a0
+    palette[:, 1:2] = a1
+    six_mode = a0 <= a1
+    palette[:, 2:6] = np.where(six_mode, six, eight[:, :4])
+    palette[:, 6:8] = np.where(six_mode, np.array([0, 255], np.uint16), eight[:, 4:])
+    # two 24 bit halves of the 48 bit index table, 8 pixels each
+    wide = blocks[:, 2:].astype(np.uint32).reshape(-1, 2, 3)
+    lut = wide[:, :, 0] | wide[:, :, 1] << 8 | wide[:, :, 2] << 16
+    indices = (lut[:, :, None] >> np.arange(0, 24, 3, dtype=np.uint32)) & 7
+    return _gather(palette, indices.reshape(-1, 16))
+
+
+def decode_blocks(blocks: np.ndarray, texture_format: int) -> np.ndarray:
+    """(N, block size) uint8 blocks -> (N, 16, 4) RGBA pixels of each 4x4 block in row order"""
+    if texture_format == 7:
+        return _decode_colors(blocks, False)
+    pixels = _decode_colors(blocks[:, 8:], True)
+    if texture_format == 9:
+        pixels[:, :, 3] = _decode_bc2_alpha(blocks[:, :8])
+    else:
+        pixels[:, :, 3] = _decode_bc3_alpha(blocks[:, :8])
+    return pixels
+
+
+def _block_counts(width: int, height: int):
+    return max(1, (width + 3) // 4), max(1, (height + 3) // 4)
+
+
+def _blocks(data, width: int, height: int, texture_format: int) -> np.ndarray:
+    block_size = BCN_FORMATS[texture_format][1]
+    blocks_x, blocks_y = _block_counts(width, height)
+    return np.frombuffer(data, np.uint8, blocks_x * blocks_y * block_size).reshape(-1, block_size)
+
+
+def _to_image(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    blocks_x, blocks_y = _block_counts(width, height)
+    image = pixels.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(blocks_y * 4, blocks_x * 4, 4)
+    return image[:height, :width]
+
+
+def decode_bcn(data, width: int, height: int, texture_format: int) -> np.ndarray:
+    """Decode a BC1/BC2/BC3 image (formats 7, 9, 11) to a (height, width, 4) uint8 RGBA array"""
+    if texture_format not in BCN_FORMATS:
+        raise NotImplementedError('Format:{} is not supported yet'.format(texture_format))
+    pixels = decode_blocks(_blocks(data, width, height, texture_format), texture_format)
+    return np.ascontiguousarray(_to_image(pixels, width, height))
+
+
+def decode_bcn_batch(images: Sequence[Tuple[object, int, int, int]]) -> List[np.ndarray]:
+    """
+    Decode (data, width, height, format) images. A convenience over decode_bcn: each image is already decoded in
+    one vectorized pass, concatenating the blocks of several images measured slower than decoding them one by one
+    """
+    return [decode_bcn(*image) for image in images]
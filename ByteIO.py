@@ -1,15 +1,104 @@
 import contextlib
 import io
+import mmap
+import os
 import struct
+import sys
 import typing
 from io import BytesIO
-from typing import List
+from typing import Dict
+
+import numpy as np
 
 
 class OffsetOutOfBounds(Exception):
     pass
 
 
+_STRUCTS = {}  # type: Dict[str, struct.Struct]
+
+
+def get_struct(fmt) -> struct.Struct:
+    """Compiled struct for fmt, compiled once per format string"""
+    codec = _STRUCTS.get(fmt)
+    if codec is None:
+        codec = _STRUCTS[fmt] = struct.Struct(fmt)
+    return codec
+
+
+_UINT64 = get_struct('Q')
+_INT64 = get_struct('q')
+_UINT32 = get_struct('I')
+_INT32 = get_struct('i')
+_UINT16 = get_struct('H')
+_INT16 = get_struct('h')
+_UINT8 = get_struct('B')
+_INT8 = get_struct('b')
+_FLOAT = get_struct('f')
+_DOUBLE = get_struct('d')
+_FLOAT16 = get_struct('e')
+
+
+class MemoryViewIO:
+    """Read-only file-like object over a buffer, reads return zero-copy memoryview slices"""
+    __slots__ = ('_source', '_view', '_pos')
+    mode = 'rb'
+
+    def __init__(self, buffer, source=None):
+        self._source = source
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls(b'')
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, mapped)
+
+    def getbuffer(self):
+        return self._view
+
+    def unpack(self, codec: struct.Struct):
+        values = codec.unpack_from(self._view, self._pos)
+        self._pos += codec.size
+        return values
+
+    def peek_unpack(self, codec: struct.Struct):
+        return codec.unpack_from(self._view, self._pos)
+
+    def read(self, size=-1):
+        start = self._pos
+        end = len(self._view) if size is None or size < 0 else min(start + size, len(self._view))
+        self._pos = max(start, end)
+        return self._view[start:end]
+
+    def seek(self, off, pos=io.SEEK_SET):
+        if pos == io.SEEK_SET:
+            self._pos = off
+        elif pos == io.SEEK_CUR:
+            self._pos += off
+        elif pos == io.SEEK_END:
+            self._pos = len(self._view) + off
+        if self._pos < 0:
+            raise ValueError('negative seek position {}'.format(self._pos))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        if self._source is not None:
+            try:
+                self._source.close()
+            except BufferError:
+                # slices handed out by read() are still alive, mapping is freed with the last of them
+                pass
+            self._source = None
+
+
 class ByteIO:
     @contextlib.contextmanager
     def save_current_pos(self):
@@ -17,14 +106,19 @@ class ByteIO:
         yield
         self.seek(entry)
 
-    def __init__(self, file=None, path=None, byte_object=None, mode='r', copy_data_from_handle=True):
+    def __init__(self, file=None, path=None, byte_object=None, mode='r', copy_data_from_handle=True, use_mmap=False,
+                 cache_strings=False):
 
         """
         Supported file handlers
         :type byte_object: bytes
         :type path: str,Path
         :type file: typing.BinaryIO
+        :param use_mmap: map the file at path instead of copying it into memory,
+         reads then return memoryview slices of the mapping
+        :param cache_strings: reuse one interned str per distinct raw string read by read_ascii_string
         """
+        self._string_cache = {} if cache_strings else None  # type: Dict[bytes, str]
         if file:
             if 'w' in file.mode:
                 self.file = file
@@ -36,6 +130,8 @@ class ByteIO:
         elif path:
             if 'w' in mode:
                 self.file = open(path, mode + 'b')
+            elif 'r' in mode and use_mmap:
+                self.file = MemoryViewIO.from_path(path)
             elif 'r' in mode:
                 with open(path, mode + 'b') as f:
                     self.file = io.BytesIO(f.read())
@@ -44,6 +140,16 @@ class ByteIO:
             self.file = io.BytesIO(byte_object)
         else:
             self.file = BytesIO()
+        self._bind_unpackers()
+
+    def _bind_unpackers(self):
+        # buffer backed files decode straight from the buffer with unpack_from, others go through read()
+        if isinstance(self.file, MemoryViewIO):
+            self._unpack = self.file.unpack
+            self._peek_unpack = self.file.peek_unpack
+        else:
+            self.__dict__.pop('_unpack', None)
+            self.__dict__.pop('_peek_unpack', None)
 
     def __repr__(self):
         return "<ByteIO {}/{}>".format(self.tell(), self.size())
@@ -69,7 +175,9 @@ class ByteIO:
             return self.read_fmt('B' * 16)
 
     def close(self):
-        if hasattr(self.file, 'mode'):
+        if isinstance(self.file, MemoryViewIO):
+            self.file.close()
+        elif hasattr(self.file, 'mode'):
             if 'w' in getattr(self.file, 'mode'):
                 self.file.close()
 
@@ -105,6 +213,7 @@ class ByteIO:
         self.file.write(to_insert)
         self.file.write(buffer)
         self.file.seek(0)
+        self._bind_unpackers()
 
     # ------------ PEEK SECTION ------------ #
 
@@ -112,105 +221,162 @@ class ByteIO:
         with self.save_current_pos():
             return self._read(size)
 
+    def _peek_unpack_read(self, codec: struct.Struct):
+        return codec.unpack(self._peek(codec.size))
+
+    _peek_unpack = _peek_unpack_read
+
     def peek(self, t):
-        size = struct.calcsize(t)
-        return struct.unpack(t, self._peek(size))[0]
+        return self._peek_unpack(_STRUCTS.get(t) or get_struct(t))[0]
 
     def peek_fmt(self, fmt):
-        size = struct.calcsize(fmt)
-        return struct.unpack(fmt, self._peek(size))
+        return self._peek_unpack(_STRUCTS.get(fmt) or get_struct(fmt))
 
     def peek_uint64(self):
-        return self.peek('Q')
+        return self._peek_unpack(_UINT64)[0]
 
     def peek_int64(self):
-        return self.peek('q')
+        return self._peek_unpack(_INT64)[0]
 
     def peek_uint32(self):
-        return self.peek('I')
+        return self._peek_unpack(_UINT32)[0]
 
     def peek_int32(self):
-        return self.peek('i')
+        return self._peek_unpack(_INT32)[0]
 
     def peek_uint16(self):
-        return self.peek('H')
+        return self._peek_unpack(_UINT16)[0]
 
     def peek_int16(self):
-        return self.peek('h')
+        return self._peek_unpack(_INT16)[0]
 
     def peek_uint8(self):
-        return self.peek('B')
+        return self._peek_unpack(_UINT8)[0]
 
     def peek_int8(self):
-        return self.peek('b')
+        return self._peek_unpack(_INT8)[0]
 
     def peek_float(self):
-        return self.peek('f')
+        return self._peek_unpack(_FLOAT)[0]
 
     def peek_double(self):
-        return self.peek('d')
+        return self._peek_unpack(_DOUBLE)[0]
 
     def peek_fourcc(self):
         with self.save_current_pos():
             return self.read_ascii_string(4)
 
+    def peek_array(self, dtype, count) -> np.ndarray:
+        with self.save_current_pos():
+            return self.read_array(dtype, count)
+
     # ------------ READ SECTION ------------ #
 
     def _read(self, size=-1) -> bytes:
         return self.file.read(size)
 
+    def _unpack_read(self, codec: struct.Struct):
+        return codec.unpack(self._read(codec.size))
+
+    _unpack = _unpack_read
+
     def read(self, t):
-        size = struct.calcsize(t)
-        return struct.unpack(t, self._read(size))[0]
+        return self._unpack(_STRUCTS.get(t) or get_struct(t))[0]
 
     def read_fmt(self, fmt):
-        size = struct.calcsize(fmt)
-        return struct.unpack(fmt, self._read(size))
+        return self._unpack(_STRUCTS.get(fmt) or get_struct(fmt))
 
     def read_uint64(self):
-        return self.read('Q')
+        return self._unpack(_UINT64)[0]
 
     def read_int64(self):
-        return self.read('q')
+        return self._unpack(_INT64)[0]
 
     def read_uint32(self):
-        return self.read('I')
+        return self._unpack(_UINT32)[0]
 
     def read_int32(self):
-        return self.read('i')
+        return self._unpack(_INT32)[0]
 
     def read_uint16(self):
-        return self.read('H')
+        return self._unpack(_UINT16)[0]
 
     def read_int16(self):
-        return self.read('h')
+        return self._unpack(_INT16)[0]
 
     def read_uint8(self):
-        return self.read('B')
+        return self._unpack(_UINT8)[0]
 
     def read_int8(self):
-        return self.read('b')
+        return self._unpack(_INT8)[0]
 
     def read_float(self):
-        return self.read('f')
+        return self._unpack(_FLOAT)[0]
 
     def read_double(self):
-        return self.read('d')
+        return self._unpack(_DOUBLE)[0]
+
+    def decode_ascii_string(self, raw: bytes) -> str:
+        # every byte maps to the code point of the same value
+        cache = self._string_cache
+        if cache is None:
+            return raw.decode('latin-1')
+        string = cache.get(raw)
+        if string is None:
+            string = cache[raw] = sys.intern(raw.decode('latin-1'))
+        return string
 
     def read_ascii_string(self, length=None):
         if length:
-            return bytes(''.join([chr(self.read_uint8()) for _ in range(length)]), 'utf').strip(b'\x00').decode('utf')
-
-        acc = ''
-        b = self.read_uint8()
-        while b != 0:
-            acc += chr(b)
-            b = self.read_uint8()
-        return acc
+            if length < 0:
+                return ''
+            return self.decode_ascii_string(bytes(self._read(length)).strip(b'\x00'))
+
+        start = self.tell()
+        chunks = []
+        while True:
+            chunk = bytes(self._read(64))
+            if not chunk:
+                raise struct.error('unterminated string at offset {}'.format(start))
+            end = chunk.find(0)
+            if end != -1:
+                chunks.append(chunk[:end])
+                self.rewind(len(chunk) - end - 1)
+                return self.decode_ascii_string(b''.join(chunks))
+            chunks.append(chunk)
 
     def read_fourcc(self):
         return self.read_ascii_string(4)
 
+    def read_array(self, dtype, count) -> np.ndarray:
+        """
+        Read count elements of dtype as one array.
+        Buffer backed readers return a read-only view into the buffer, other readers copy the span once.
+        """
+        dtype = np.dtype(dtype)
+        size = dtype.itemsize * count
+        if isinstance(self.file, MemoryViewIO):
+            array = np.frombuffer(self.file.getbuffer(), dtype, count, self.tell())
+            self.skip(size)
+            return array
+        return np.frombuffer(self._read(size), dtype, count)
+
+    def read_records(self, dtype, count, stride=None) -> np.ndarray:
+        """
+        Read count records of a structured dtype placed stride bytes apart (defaults to the itemsize),
+        fields may lie anywhere in a record. Advances by count * stride.
+        """
+        dtype = np.dtype(dtype)
+        stride = dtype.itemsize if stride is None else stride
+        if isinstance(self.file, MemoryViewIO):
+            buffer, offset = self.file.getbuffer(), self.tell()
+        else:
+            with self.save_current_pos():
+                buffer, offset = self._read(stride * (count - 1) + dtype.itemsize if count else 0), 0
+        array = np.ndarray((count,), dtype, buffer, offset, (stride,))
+        self.skip(stride * count)
+        return array
+
     def read_from_offset(self, offset, reader, **reader_args):
         if offset > self.size():
             raise OffsetOutOfBounds()
@@ -227,7 +393,7 @@ class ByteIO:
         self.file.write(data)
 
     def write(self, t, value):
-        self._write(struct.pack(t, value))
+        self._write(get_struct(t).pack(value))
 
     def write_uint64(self, value):
         self.write('Q', value)
@@ -284,43 +450,96 @@ class ByteIO:
         return ret
 
     def read_bytes(self, size):
+        """bytes, or a memoryview slice of the mapping when opened with use_mmap"""
         return self._read(size)
 
     def read_float16(self):
-        return self.read('e')
+        return self._unpack(_FLOAT16)[0]
 
     def write_bytes(self, data):
         self._write(data)
 
-    def get_list(self, obj_type: int) -> List['DataChunk']:
-        lst = []
+    def get_list(self, obj_type: int) -> 'ChunkTable':
         if obj_type >= 128:
             count_s = obj_type - 128
             count_b = self.read_int32()
-            lst.extend([DataChunk(*self.read_fmt('BB'), self) for _ in range(count_s)])
-            lst.extend([DataChunk(*self.read_fmt('ii'), self) for _ in range(count_b)])
         else:
-            lst.extend([DataChunk(*self.read_fmt('BB'), self) for _ in range(obj_type)])
+            count_s = obj_type
+            count_b = 0
+        if count_s + count_b <= SMALL_CHUNK_TABLE:
+            # numpy call overhead outweighs the work on the short lists most chunks carry
+            short_entries = self._unpack(get_struct('{}B'.format(count_s * 2)))
+            long_entries = self._unpack(get_struct('{}i'.format(count_b * 2)))
+            entries = short_entries + long_entries
+            # offsets are relative to the end of the table
+            pos = self.tell()
+            return ChunkTable(self, entries[0::2], [offset + pos for offset in entries[1::2]])
+        short_entries = self.read_array(SHORT_CHUNK_ENTRY, count_s)
+        long_entries = self.read_array(LONG_CHUNK_ENTRY, count_b)
         pos = self.tell()
-        out = []
-        for item in lst:
-            item.offset += pos
-            out.append(item)
-            # out.append([item[0], pos + item[1]])
-        return out
+        types = np.concatenate((short_entries['type'], long_entries['type'])).astype(np.int32)
+        offsets = np.concatenate((short_entries['offset'], long_entries['offset'])).astype(np.int64)
+        offsets += pos
+        return ChunkTable(self, types, offsets)
 
     @staticmethod
-    def filter_items(to_filter: List['DataChunk'], obj_id) -> List['DataChunk']:
-        return list(filter(lambda a: a.type == obj_id, to_filter))
+    def filter_items(to_filter: 'ChunkTable', obj_id) -> 'ChunkTable':
+        if isinstance(to_filter, ChunkTable):
+            return to_filter.filter(obj_id)
+        return [item for item in to_filter if item.type == obj_id]
 
-    def get_items(self) -> List['DataChunk']:
+    def get_items(self) -> 'ChunkTable':
         list_type = self.read_uint8()
         return self.get_list(list_type)
 
 
+SMALL_CHUNK_TABLE = 32
+SHORT_CHUNK_ENTRY = np.dtype([('type', 'u1'), ('offset', 'u1')])
+LONG_CHUNK_ENTRY = np.dtype([('type', 'i4'), ('offset', 'i4')])
+
+
+class ChunkTable:
+    """
+    Chunk list stored as parallel type/offset arrays, items are materialized as DataChunk views on access.
+    Short lists keep plain int sequences, long ones numpy arrays.
+    """
+    __slots__ = ('reader', 'types', 'offsets')
+
+    def __init__(self, reader: 'ByteIO', types: typing.Sequence[int], offsets: typing.Sequence[int]):
+        self.reader = reader
+        self.types = types
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self) -> typing.Iterator['DataChunk']:
+        reader = self.reader
+        types, offsets = self.types, self.offsets
+        if isinstance(types, np.ndarray):
+            types, offsets = types.tolist(), offsets.tolist()
+        for chunk_type, offset in zip(types, offsets):
+            yield DataChunk(chunk_type, offset, reader)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ChunkTable(self.reader, self.types[item], self.offsets[item])
+        if isinstance(item, np.ndarray):
+            return ChunkTable(self.reader, np.asarray(self.types)[item], np.asarray(self.offsets)[item])
+        return DataChunk(int(self.types[item]), int(self.offsets[item]), self.reader)
+
+    def filter(self, obj_id) -> 'ChunkTable':
+        return self[np.asarray(self.types) == obj_id]
+
+    def __repr__(self):
+        return '<ChunkTable entries:{}>'.format(len(self))
+
+
 class DataChunk:
+    __slots__ = ('reader', 'type', 'offset')
+
     def __init__(self, t, o, r):
-        self.reader:'ByteIO' = r
+        self.reader: 'ByteIO' = r
         self.type = t
         self.offset = o
 
@@ -333,7 +552,7 @@ class DataChunk:
     def seek_to(self):
         self.reader.seek(self.offset)
 
-    def get_items(self) -> List['DataChunk']:
+    def get_items(self) -> 'ChunkTable':
         return self.reader.get_items()
 
     def __repr__(self):
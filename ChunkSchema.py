@@ -0,0 +1,129 @@
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from ByteIO import ByteIO
+
+
+def read_string(reader: ByteIO) -> str:
+    return reader.read_ascii_string(reader.read_int32())
+
+
+def read_path(reader: ByteIO) -> Path:
+    return Path(read_string(reader))
+
+
+INT32 = ByteIO.read_int32
+UINT32 = ByteIO.read_uint32
+STRING = read_string
+PATH = read_path
+OFFSET = ByteIO.tell  # position of the chunk body, for payloads read later
+
+
+class Field:
+    """Leaf chunk, read stores its value in attr of the asset (or of the enclosing record)"""
+    __slots__ = ('attr', 'read', 'append')
+
+    def __init__(self, attr: str, read: Callable[[ByteIO], object], append=False):
+        self.attr = attr
+        self.read = read
+        self.append = append  # append to a list instead of assigning
+
+
+class Chunk:
+    """
+    Chunk holding a chunk list.
+    Body layout: optional 4 byte flag, skip bytes, then the list. Items are dispatched by type through fields,
+    or all go to each. Items of other types are ignored, as are chunks whose flag does not match.
+    A record chunk collects its fields into a fresh dict instead of asset attributes.
+    ends maps a chunk type to an attr receiving where that chunk's bytes end: the offset of the next chunk in the
+    list, left unset for the last one.
+    then(asset, reader, target) runs after the list was walked, target is the record or the asset.
+    """
+    __slots__ = ('fields', 'each', 'flag', 'skip', 'limit', 'record', 'ends', 'then')
+
+    def __init__(self, fields: Optional[Dict[int, Union[Field, 'Chunk']]] = None, each: Optional['Chunk'] = None,
+                 flag: Optional[Tuple[int, int, int, int]] = None, skip=0, limit=None, record=False,
+                 ends: Optional[Dict[int, str]] = None, then=None):
+        self.fields = fields or {}
+        self.each = each
+        self.flag = flag
+        self.skip = skip
+        self.limit = limit
+        self.record = record
+        self.ends = ends or {}
+        self.then = then
+
+
+def _compile_field(field: Field, in_record: bool):
+    attr, read = field.attr, field.read
+    if in_record and field.append:
+        def read_field(reader, asset, target):
+            target.setdefault(attr, []).append(read(reader))
+    elif in_record:
+        def read_field(reader, asset, target):
+            target[attr] = read(reader)
+    elif field.append:
+        def read_field(reader, asset, target):
+            getattr(target, attr).append(read(reader))
+    else:
+        def read_field(reader, asset, target):
+            setattr(target, attr, read(reader))
+    return read_field
+
+
+def _compile_chunk(chunk: Chunk, in_record: bool):
+    in_record = in_record or chunk.record
+    handlers = {chunk_type: _compile_node(node, in_record) for chunk_type, node in chunk.fields.items()}
+    each = _compile_node(chunk.each, in_record) if chunk.each is not None else None
+    flag, skip, limit, record, then = chunk.flag, chunk.skip, chunk.limit, chunk.record, chunk.then
+    ends = chunk.ends
+    set_end = dict.__setitem__ if in_record else setattr
+
+    def read_chunk(reader: ByteIO, asset, target):
+        if flag is not None and reader.read_fmt('BBBB') != flag:
+            return
+        if skip:
+            reader.skip(skip)
+        items = reader.get_items()
+        if record:
+            target = {}
+        if ends:
+            # every chunk of the list bounds the others, not only the ones read
+            starts = sorted(int(offset) for offset in items.offsets)
+            for item in items:
+                following = [start for start in starts if start > item.offset]
+                if item.type in ends and following:
+                    set_end(target, ends[item.type], following[0])
+        if limit is not None:
+            items = items[:limit]
+        for item in items:
+            handler = each or handlers.get(item.type)
+            if handler is not None:
+                reader.seek(item.offset)
+                handler(reader, asset, target)
+        if then is not None:
+            then(asset, reader, target)
+
+    return read_chunk
+
+
+def _compile_node(node, in_record: bool):
+    if isinstance(node, Field):
+        return _compile_field(node, in_record)
+    return _compile_chunk(node, in_record)
+
+
+class SchemaReader:
+    """Reader compiled from a schema, called with the reader at the start of the chunk body and the asset to fill"""
+    __slots__ = ('schema', '_read_chunk')
+
+    def __init__(self, schema: Chunk):
+        self.schema = schema
+        self._read_chunk = _compile_chunk(schema, False)
+
+    def __call__(self, reader: ByteIO, asset):
+        self._read_chunk(reader, asset, asset)
+
+
+def compile_schema(schema: Chunk) -> SchemaReader:
+    return SchemaReader(schema)
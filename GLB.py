@@ -0,0 +1,232 @@
+import io
+import json
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+GLB_MAGIC = b'glTF'
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+TARGET_ARRAY_BUFFER = 34962
+TARGET_ELEMENT_ARRAY_BUFFER = 34963
+# numpy dtype -> accessor componentType
+COMPONENT_TYPES = {
+    np.dtype(np.uint8): 5121,
+    np.dtype(np.uint16): 5123,
+    np.dtype(np.uint32): 5125,
+    np.dtype(np.float32): 5126,
+}
+ACCESSOR_TYPES = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4', 16: 'MAT4'}
+# material slot -> glTF material texture
+MATERIAL_SLOTS = {'diffuse': 'baseColorTexture', 'normal': 'normalTexture', 'glow': 'emissiveTexture'}
+
+
+def _pad(data: bytes, fill=b'\x00') -> bytes:
+    return data + fill * (-len(data) % 4)
+
+
+class GLBWriter:
+    """glTF 2.0 document with one binary buffer, every array is stored as a typed, 4 byte aligned buffer view"""
+
+    def __init__(self):
+        self.gltf = {
+            'asset': {'version': '2.0', 'generator': 'PRP_IO'},
+            'scene': 0, 'scenes': [{'nodes': []}], 'nodes': [], 'meshes': [], 'skins': [],
+            'materials': [], 'textures': [], 'images': [], 'samplers': [{}],
+            'accessors': [], 'bufferViews': [], 'buffers': [],
+        }
+        self.chunks = []  # type: List[bytes]
+        self.size = 0
+
+    def add_view(self, data: bytes, target: Optional[int] = None) -> int:
+        view = {'buffer': 0, 'byteOffset': self.size, 'byteLength': len(data)}
+        if target is not None:
+            view['target'] = target
+        self.chunks.append(_pad(data))
+        self.size += len(self.chunks[-1])
+        self.gltf['bufferViews'].append(view)
+        return len(self.gltf['bufferViews']) - 1
+
+    def add_accessor(self, array: np.ndarray, target: Optional[int] = None, bounds=False) -> int:
+        """(N,) or (N, components) array of a componentType dtype"""
+        array = np.ascontiguousarray(array)
+        components = array.shape[1] if array.ndim > 1 else 1
+        accessor = {
+            'bufferView': self.add_view(array.tobytes(), target),
+            'componentType': COMPONENT_TYPES[array.dtype],
+            'count': len(array),
+            'type': ACCESSOR_TYPES[components],
+        }
+        if bounds and len(array):
+            accessor['min'] = array.reshape(len(array), -1).min(0).tolist()
+            accessor['max'] = array.reshape(len(array), -1).max(0).tolist()
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def add_image(self, pixels: np.ndarray, name: str) -> int:
+        buffer = io.BytesIO()
+        Image.fromarray(pixels, 'RGBA').save(buffer, 'PNG')
+        view = self.add_view(buffer.getvalue())
+        self.gltf['images'].append({'name': name, 'mimeType': 'image/png', 'bufferView': view})
+        self.gltf['textures'].append({'source': len(self.gltf['images']) - 1, 'sampler': 0})
+        return len(self.gltf['textures']) - 1
+
+    def add_node(self, node: dict) -> int:
+        self.gltf['nodes'].append(node)
+        return len(self.gltf['nodes']) - 1
+
+    def write(self, path: Path):
+        gltf = {key: value for key, value in self.gltf.items() if value != []}
+        if self.size:
+            gltf['buffers'] = [{'byteLength': self.size}]
+        json_chunk = _pad(json.dumps(gltf, separators=(',', ':')).encode('utf-8'), b' ')
+        length = 12 + 8 + len(json_chunk) + (8 + self.size if self.size else 0)
+        with path.open('wb') as fp:
+            fp.write(struct.pack('<4s2I', GLB_MAGIC, GLB_VERSION, length))
+            fp.write(struct.pack('<2I', len(json_chunk), CHUNK_JSON))
+            fp.write(json_chunk)
+            if self.size:
+                fp.write(struct.pack('<2I', self.size, CHUNK_BIN))
+                for chunk in self.chunks:
+                    fp.write(chunk)
+
+
+def _bind_matrices(bones) -> np.ndarray:
+    """(bones, 4, 4) model space matrices of bones whose matrix is relative to the parent and column major"""
+    local = np.array([bone.matrix for bone in bones], np.float64).reshape(-1, 4, 4).transpose(0, 2, 1)
+    world = [None] * len(bones)  # type: List[Optional[np.ndarray]]
+
+    def resolve(n):
+        if world[n] is None:
+            parent = bones[n].parent
+            world[n] = local[n] if not 0 <= parent < len(bones) or parent == n else resolve(parent) @ local[n]
+        return world[n]
+
+    return np.array([resolve(n) for n in range(len(bones))]).reshape(-1, 4, 4)
+
+
+def _uv_set(name: str) -> Optional[int]:
+    """uv set number of a vertex attribute: uv -> 0, uv1 -> 1..., None for other attributes"""
+    if name == 'uv':
+        return 0
+    return int(name[2:]) if name[:2] == 'uv' and name[2:].isdigit() else None
+
+
+def _skin_attributes(mesh, bone_map, joint_of_skin_id: Dict[int, int]):
+    """JOINTS_n/WEIGHTS_n arrays: bone map slots remapped to skin joints, weights normalized to sum to 1"""
+    indices = mesh.weight_inds.astype(np.int64)
+    weights = mesh.weight_weight.astype(np.float32) / 255
+    if bone_map is not None and len(bone_map):
+        skin_ids = np.asarray(bone_map)[np.clip(indices, 0, len(bone_map) - 1)]
+        unique, inverse = np.unique(skin_ids, return_inverse=True)
+        joints = np.array([joint_of_skin_id.get(int(skin_id), 0) for skin_id in unique], np.int64)[inverse]
+        joints = joints.reshape(indices.shape)
+    else:
+        joints = indices
+    joints = np.where(weights > 0, joints, 0)
+    total = weights.sum(1, keepdims=True)
+    weights = np.where(total > 0, weights / np.where(total > 0, total, 1), 0)
+    weights[total[:, 0] == 0, 0] = 1  # unweighted vertices follow their first joint
+    influences = -(-weights.shape[1] // 4) * 4
+    joints = np.pad(joints, ((0, 0), (0, influences - joints.shape[1])))
+    weights = np.pad(weights, ((0, 0), (0, influences - weights.shape[1])))
+    joint_type = np.uint8 if max(joint_of_skin_id.values(), default=0) < 256 else np.uint16
+    return [(joints[:, n:n + 4].astype(joint_type), weights[:, n:n + 4]) for n in range(0, influences, 4)]
+
+
+def export_glb(prp, path: Path, textures=True) -> Path:
+    """
+    Write the models of a PRP as binary glTF: a node per model with its bone hierarchy as a skin and a node per
+    mesh/material pair, vertices and indices in typed buffer views, textures embedded as PNG.
+    Assets are taken from the table of contents and decoded on demand, read(lazy=True) is enough.
+    """
+    writer = GLBWriter()
+    materials = {}  # type: Dict[str, int]
+    image_textures = {}  # type: Dict[str, Optional[int]]
+
+    def texture_index(texture) -> Optional[int]:
+        if texture.chunk_name not in image_textures:
+            try:
+                pixels = texture.pixels(prp.reader)
+            except NotImplementedError:
+                pixels = None
+            image_textures[texture.chunk_name] = None if pixels is None else writer.add_image(pixels, str(texture.name))
+        return image_textures[texture.chunk_name]
+
+    def material_index(sub_mesh) -> Optional[int]:
+        material = sub_mesh.material
+        if material is None:
+            return None
+        if material.chunk_name not in materials:
+            gltf_material = {'name': material.name, 'pbrMetallicRoughness': {'metallicFactor': 0}}
+            for slot, texture in sub_mesh.textures.items():
+                index = texture_index(texture) if textures and slot in MATERIAL_SLOTS else None
+                if index is None:
+                    continue
+                if slot == 'diffuse':
+                    gltf_material['pbrMetallicRoughness'][MATERIAL_SLOTS[slot]] = {'index': index}
+                else:
+                    gltf_material[MATERIAL_SLOTS[slot]] = {'index': index}
+                    if slot == 'glow':
+                        gltf_material['emissiveFactor'] = [1, 1, 1]
+            writer.gltf['materials'].append(gltf_material)
+            materials[material.chunk_name] = len(writer.gltf['materials']) - 1
+        return materials[material.chunk_name]
+
+    for entry in prp.toc:
+        if entry.kind != 'model':
+            continue
+        model = prp.load(entry)
+        root = {'name': model.name, 'children': []}
+        root_index = writer.add_node(root)
+        writer.gltf['scenes'][0]['nodes'].append(root_index)
+        skin = None
+        joint_of_skin_id = {}
+        if model.bones:
+            joints = [writer.add_node({'name': bone.name, 'matrix': list(bone.matrix)}) for bone in model.bones]
+            for n, (bone, joint) in enumerate(zip(model.bones, joints)):
+                if 0 <= bone.parent < len(joints) and bone.parent != n:
+                    writer.gltf['nodes'][joints[bone.parent]].setdefault('children', []).append(joint)
+                else:
+                    root['children'].append(joint)
+            inverse_bind = np.linalg.inv(_bind_matrices(model.bones)).transpose(0, 2, 1).reshape(-1, 16)
+            writer.gltf['skins'].append({'name': model.name, 'joints': joints,
+                                         'inverseBindMatrices': writer.add_accessor(inverse_bind.astype(np.float32))})
+            skin = len(writer.gltf['skins']) - 1
+            joint_of_skin_id = {bone.skin_id: n for n, bone in enumerate(model.bones)}
+        for sub_mesh in prp.resolve_model(model):
+            mesh = sub_mesh.mesh
+            if mesh is None or not mesh.mode or not len(mesh.vertices):
+                continue
+            attributes = {'POSITION': writer.add_accessor(mesh.vertices.astype(np.float32), TARGET_ARRAY_BUFFER,
+                                                          bounds=True)}
+            uv_names = sorted((name for name in mesh.vertex_data if _uv_set(name) is not None), key=_uv_set)
+            for n, name in enumerate(uv_names):
+                # glTF and the archive share the top left uv origin, unlike the flipped uvs of model.json
+                attributes['TEXCOORD_{}'.format(n)] = writer.add_accessor(
+                    mesh.vertex_data[name][:, :2].astype(np.float32), TARGET_ARRAY_BUFFER)
+            skinned = skin is not None and mesh.weight_inds.size
+            if skinned:
+                for n, (joints, weights) in enumerate(_skin_attributes(mesh, sub_mesh.bone_map, joint_of_skin_id)):
+                    attributes['JOINTS_{}'.format(n)] = writer.add_accessor(joints, TARGET_ARRAY_BUFFER)
+                    attributes['WEIGHTS_{}'.format(n)] = writer.add_accessor(weights, TARGET_ARRAY_BUFFER)
+            triangles = mesh.triangles().ravel()
+            triangles = triangles.astype(np.uint16 if len(mesh.vertices) < 0xFFFF else np.uint32)  # 0xFFFF is reserved
+            primitive = {'attributes': attributes,
+                         'indices': writer.add_accessor(triangles, TARGET_ELEMENT_ARRAY_BUFFER)}
+            material = material_index(sub_mesh)
+            if material is not None:
+                primitive['material'] = material
+            writer.gltf['meshes'].append({'name': mesh.name, 'primitives': [primitive]})
+            node = {'name': mesh.name, 'mesh': len(writer.gltf['meshes']) - 1}
+            if skinned:
+                node['skin'] = skin
+            root['children'].append(writer.add_node(node))
+        if not root['children']:
+            del root['children']
+    writer.write(path)
+    return path
@@ -0,0 +1,63 @@
+import base64
+import json
+from typing import IO, Iterable, Mapping, Tuple, Union
+
+import numpy as np
+
+# key of a packed array object: {"__ndarray__": "<f4", "shape": [n, 3], "data": "<base64>"}
+ARRAY_TAG = '__ndarray__'
+
+Section = Union[Mapping[str, object], Iterable[Tuple[str, object]]]
+
+
+def encode_array(array: np.ndarray) -> dict:
+    """Typed array as a json object: dtype tag, shape and the raw bytes in base64"""
+    array = np.ascontiguousarray(array)
+    return {ARRAY_TAG: array.dtype.str, 'shape': list(array.shape),
+            'data': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def decode_array(obj: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(obj['data']), np.dtype(obj[ARRAY_TAG])).reshape(obj['shape'])
+
+
+def array_hook(obj: dict):
+    """json object_hook, packed arrays are loaded as numpy arrays"""
+    return decode_array(obj) if ARRAY_TAG in obj else obj
+
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        return encode_array(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def write_json(fp: IO[str], sections: Iterable[Tuple[str, Section]], compact=False):
+    """
+    Write {section: {key: value}} one value at a time, a value can be freed as soon as it is written.
+    Sections are mappings or (key, value) iterables, e.g. generators serializing one asset per item.
+    The default layout is the one of json.dump(..., indent=1), compact drops whitespace and packs
+    numpy arrays with encode_array.
+    """
+    if compact:
+        encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+        section_line, item_line, key_separator = '', '', ':'
+    else:
+        encoder = json.JSONEncoder(indent=1, default=_default)
+        section_line, item_line, key_separator = '\n ', '\n  ', ': '
+    encode = encoder.encode
+    fp.write('{')
+    for n, (name, items) in enumerate(sections):
+        fp.write((',' if n else '') + section_line + encode(name) + key_separator)
+        if isinstance(items, Mapping):
+            items = items.items()
+        empty = True
+        for key, value in items:
+            # nested lines of the value move two levels in, under its section and key
+            fp.write(('{' if empty else ',') + item_line + encode(key) + key_separator +
+                     encode(value).replace('\n', item_line))
+            empty = False
+        fp.write('{}' if empty else section_line + '}')
+    fp.write(section_line[:-1] + '}')
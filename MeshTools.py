@@ -0,0 +1,132 @@
+from collections import deque
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def strip_to_list(indices) -> np.ndarray:
+    """
+    Triangle strip -> (N, 3) triangle list, odd triangles keep the strip order and even ones swap their last two
+    corners, degenerate triangles (a repeated index) are dropped
+    """
+    indices = np.asarray(indices)
+    count = len(indices) - 2
+    if count <= 0:
+        return np.empty((0, 3), indices.dtype)
+    first, second, third = indices[:-2], indices[1:-1], indices[2:]
+    odd = np.arange(count) & 1 == 1
+    triangles = np.empty((count, 3), indices.dtype)
+    triangles[:, 0] = first
+    triangles[:, 1] = np.where(odd, second, third)
+    triangles[:, 2] = np.where(odd, third, second)
+    return triangles[(first != second) & (second != third) & (first != third)]
+
+
+def weld(columns: Dict[str, np.ndarray], triangles: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Merge vertices whose data is identical in every column, columns hold one row per vertex.
+    Vertices are looked up in a hash index of their bytes, in one pass without sorting.
+    Returns the welded columns, in order of first occurrence, and the triangles indexing them.
+    """
+    rows = [np.ascontiguousarray(column).view(np.uint8).reshape(len(column), -1) for column in columns.values()]
+    if not rows:
+        return columns, triangles
+    keys = np.ascontiguousarray(np.concatenate(rows, 1))
+    width = keys.shape[1]
+    data = keys.tobytes()
+    index = {}  # vertex bytes -> welded vertex, numbered in order of first occurrence
+    remap = np.fromiter((index.setdefault(data[start:start + width], len(index))
+                         for start in range(0, len(data), width)), np.int64, len(keys))
+    kept = np.empty(len(index), np.int64)
+    kept[remap[::-1]] = np.arange(len(remap) - 1, -1, -1)  # the first vertex of each group
+    return {name: column[kept] for name, column in columns.items()}, remap[triangles]
+
+
+def acmr(triangles: np.ndarray, cache_size=16) -> float:
+    """Average cache miss ratio, transformed vertices per triangle with a FIFO post-transform cache"""
+    if not len(triangles):
+        return 0.0
+    cache = deque(maxlen=cache_size)
+    cached = set()
+    misses = 0
+    for vertex in triangles.ravel().tolist():
+        if vertex not in cached:
+            misses += 1
+            if len(cache) == cache_size:
+                cached.discard(cache[0])
+            cache.append(vertex)
+            cached.add(vertex)
+    return misses / len(triangles)
+
+
+def tipsify(triangles: np.ndarray, vertex_count: int, cache_size=16) -> np.ndarray:
+    """
+    Reorder triangles for the post-transform vertex cache,
+    Sander, Nehab, Barczak: Fast Triangle Reordering for Vertex Locality and Reduced Overdraw (2007)
+    """
+    triangle_count = len(triangles)
+    if not triangle_count:
+        return triangles
+    corners = triangles.ravel()
+    # triangles using each vertex, as a CSR table
+    by_vertex = np.argsort(corners, kind='stable') // 3
+    starts = np.zeros(vertex_count + 1, np.int64)
+    np.cumsum(np.bincount(corners, minlength=vertex_count), out=starts[1:])
+    starts = starts.tolist()
+    by_vertex = by_vertex.tolist()
+    tris = triangles.tolist()
+    live = np.bincount(corners, minlength=vertex_count).tolist()
+    cache_time = [0] * vertex_count
+    emitted = [False] * triangle_count
+    dead_ends = []
+    order = []
+    time_stamp = cache_size + 1
+    cursor = 1
+    vertex = 0
+    while vertex >= 0:
+        candidates = {}
+        for triangle in by_vertex[starts[vertex]:starts[vertex + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            order.append(triangle)
+            for corner in tris[triangle]:
+                dead_ends.append(corner)
+                candidates[corner] = None
+                live[corner] -= 1
+                if time_stamp - cache_time[corner] > cache_size:
+                    cache_time[corner] = time_stamp
+                    time_stamp += 1
+        # next fanning vertex: the candidate that stays in the cache longest once fanned
+        vertex = -1
+        best = -1
+        for candidate in candidates:
+            if live[candidate] > 0:
+                priority = 0
+                if time_stamp - cache_time[candidate] + 2 * live[candidate] <= cache_size:
+                    priority = time_stamp - cache_time[candidate]
+                if priority > best:
+                    best = priority
+                    vertex = candidate
+        if vertex == -1:
+            while dead_ends:
+                candidate = dead_ends.pop()
+                if live[candidate] > 0:
+                    vertex = candidate
+                    break
+        if vertex == -1:
+            while cursor < vertex_count:
+                if live[cursor] > 0:
+                    vertex = cursor
+                    break
+                cursor += 1
+    return triangles[order]
+
+
+def fetch_order(triangles: np.ndarray, vertex_count: int) -> np.ndarray:
+    """Vertex order of first use by the triangles, unused vertices are left out"""
+    corners = triangles.ravel()
+    first_use = np.full(vertex_count, len(corners), np.int64)
+    np.minimum.at(first_use, corners, np.arange(len(corners)))
+    used = np.flatnonzero(first_use < len(corners))
+    return used[np.argsort(first_use[used], kind='stable')]
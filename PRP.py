@@ -1,19 +1,149 @@
+import argparse
+import contextlib
+import functools
+import glob
+import hashlib
+import io
 import json
 import os
+import struct
+import sys
+import threading
+import time
+import traceback
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from PIL import Image
 
+from AssetFilter import AssetFilter
+from BCn import BCN_FORMATS, dds_header, decode_bcn, decode_bcn_batch, level_size
 from ByteIO import ByteIO
+from ChunkSchema import Chunk, Field, INT32, OFFSET, PATH, STRING, UINT32, compile_schema
+from GLB import export_glb
+from JsonStream import write_json
+from MeshTools import acmr, fetch_order, strip_to_list, tipsify, weld
+from VertexLayout import VertexLayout, compile_layout
+
+FRAME16 = np.dtype((np.uint8, 16))
+FRAME8 = np.dtype((np.uint8, 8))
+FRAME6 = np.dtype((np.uint8, 6))
+BONE_ENTRY = np.dtype({'names': ['name', 'matrix', 'skin_id', 'parent'],
+                       'formats': ['S32', ('f4', 16), 'i4', 'i4'],
+                       'offsets': [0, 32, 124, 128],
+                       'itemsize': 144})
+
+
+class AssetEntry:
+    """Table of contents entry of one asset in the type 26 list, asset is set once it was decoded"""
+    __slots__ = ('kind', 'flag', 'offset', 'size', 'chunk_name', 'name', 'header', 'asset')
+
+    def __init__(self, kind: str, flag, offset: int, chunk_name='', name=''):
+        self.kind = kind
+        self.flag = flag
+        self.offset = offset  # offset of the asset chunk list, right after the flag
+        self.size = 0  # bytes up to the next asset
+        self.chunk_name = chunk_name
+        self.name = name
+        self.header = {}  # header fields of the asset class, see Asset.HEADER_FIELDS
+        self.asset = None
+
+    def __repr__(self):
+        return '<AssetEntry {} "{}" chunk:{} offset:{}>'.format(self.kind, self.name, self.chunk_name, self.offset)
+
+
+class AssetList(Sequence):
+    """Assets of one kind from a lazily read archive, each one is decoded on first access"""
+
+    def __init__(self, prp: 'PRP', entries: List[AssetEntry]):
+        self.prp = prp
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.prp.load(entry) for entry in self.entries[item]]
+        return self.prp.load(self.entries[item])
+
+    def __repr__(self):
+        return '<AssetList {}/{} decoded>'.format(sum(entry.asset is not None for entry in self.entries), len(self))
+
+
+INDEX_MAGIC = b'PRPI'
+INDEX_VERSION = 2  # 2: spans end at the next asset of the list, unknown flags included
+INDEX_HASHED_BYTES = 4096
+INDEX_HEADER_FIELDS = 4
+MANIFEST_VERSION = 2  # bump when the extracted output changes, forces a full extraction
+
+
+class JobPool:
+    """Thread pool with a bounded queue, submit blocks while max_pending jobs are waiting"""
+
+    def __init__(self, workers: int, max_pending=None):
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(max_pending or workers * 2)
+        self.futures = []
+
+    def submit(self, func, *args):
+        self.slots.acquire()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def close(self):
+        """Wait for all jobs, raises the first error of a job"""
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures.clear()
+            self.executor.shutdown()
 
 
 class PRP:
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, texture_format='tga', mip_level=0, max_texture_size=0, texture_workers=None,
+                 texture_store=None, mesh_attributes=None, triangulate=False, optimize_meshes=False, export_glb=False,
+                 compact_json=False, mesh_sidecars=False):
+        """
+        :param texture_format: 'tga' decodes textures, 'dds' writes BC1/BC2/BC3 blocks as they are
+        :param mip_level: mip level of the textures to export
+        :param max_texture_size: export smaller mip levels of textures larger than this, e.g. 256 for previews
+        :param texture_workers: threads decoding and saving textures while read walks the archive,
+         defaults to the CPU count, 0 saves them inline
+        :param texture_store: folder shared by archives, textures are saved there once under a hash of their
+         blocks and json paths point into it, instead of dump/<name>/textures
+        :param mesh_attributes: names of the vertex attributes to decode ('pos', 'uv', 'skin_ind', 'usage2'...),
+         None decodes every attribute of a mesh
+        :param triangulate: convert triangle strips to triangle lists while reading, instead of in the importer
+        :param optimize_meshes: weld and reorder meshes for rendering while reading, see Mesh.optimize
+        :param export_glb: save also writes the models as binary glTF, dump/<name>/model.glb
+        :param compact_json: model.json without indentation, vertex and index arrays packed as base64 typed
+         buffers, see JsonStream
+        :param mesh_sidecars: mesh geometry goes to dump/<name>/meshes/<chunk name>.npz, model.json only references it
+        """
         self.path = Path(path)
-        self.reader = ByteIO(path=self.path)
+        self.texture_format = texture_format
+        self.mip_level = mip_level
+        self.max_texture_size = max_texture_size
+        self.texture_workers = os.cpu_count() if texture_workers is None else texture_workers
+        self.texture_store = Path(texture_store) if texture_store is not None else None  # type: Optional[Path]
+        self.mesh_attributes = mesh_attributes
+        self.triangulate = triangulate
+        self.optimize_meshes = optimize_meshes
+        self.export_glb = export_glb
+        self.compact_json = compact_json
+        self.mesh_sidecars = mesh_sidecars
+        self.texture_pool = None  # type: Optional[JobPool]
+        self.reader = ByteIO(path=self.path, use_mmap=True, cache_strings=True)
         self.dump_path = self.path.parent / 'dump' / self.path.stem  # type: Path
+        self.index_path = self.dump_path / 'toc.idx'  # type: Path
+        self.manifest_path = self.dump_path / 'manifest.json'  # type: Path
         os.makedirs(self.dump_path, exist_ok=True)
         self.magic = b''
         self.model_name = ''
@@ -25,6 +155,22 @@ class PRP:
         self.materials = []  # type: List[Material]
         self.audio = []  # type: List[Audio]
         self.animation = []  # type: List[Animation]
+        self.toc = []  # type: List[AssetEntry]
+        self.chunk_index = {}  # type: Dict[Tuple[str, str], AssetEntry]
+        self.name_index = {}  # type: Dict[Tuple[str, str], AssetEntry]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory mapped archive. Arrays still viewing it (mesh vertex data of a mapped read) keep the
+        mapping alive until they are freed
+        """
+        self.reader.close()
 
     def to_json(self):
         data = {
@@ -35,11 +181,253 @@ class PRP:
         }
         return data
 
-    def save(self):
+    def json_sections(self):
+        """to_json sections as (chunk name, data) generators, each asset is serialized when it is written"""
+        for kind in ('model', 'mesh', 'texture', 'material'):
+            attr = ASSET_KINDS[kind][1]
+            yield attr, ((asset.chunk_name, asset_json(asset, self.compact_json)) for asset in getattr(self, attr))
+
+    def save(self, data=None):
+        """
+        Stream model.json, asset by asset
+        :param data: sections to write instead of json_sections(), mappings or (chunk name, data) iterables
+        """
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()  # describes the previous output, update() writes a new one after saving
         with (self.dump_path / 'model.json').open('w') as fp:
-            json.dump(self.to_json(), fp, indent=1)
+            write_json(fp, self.json_sections() if data is None else data.items(), self.compact_json)
+        if self.export_glb:
+            self.save_glb()
+
+    def save_glb(self, path: Optional[Path] = None) -> Path:
+        """Models, meshes, materials and textures as binary glTF, see GLB.export_glb"""
+        return export_glb(self, self.dump_path / 'model.glb' if path is None else Path(path))
+
+    def load(self, entry: AssetEntry):
+        """Decode the asset of a table of contents entry, once"""
+        if entry.asset is None:
+            asset_class, _ = ASSET_KINDS[entry.kind]
+            asset = asset_class(self.dump_path)
+            if isinstance(asset, Texture):
+                asset.export_format = self.texture_format
+                asset.mip_level = self.mip_level
+                asset.max_size = self.max_texture_size
+                asset.jobs = self.texture_pool
+                asset.store = self.texture_store
+                asset.data_end = self.entry_end(entry)  # the data chunk's own end when other chunks follow it
+            elif isinstance(asset, Mesh):
+                asset.attributes = self.mesh_attributes
+                asset.triangulate = self.triangulate
+                asset.post_process = self.optimize_meshes
+            with self.reader.save_current_pos():
+                self.reader.seek(entry.offset)
+                asset.read(self.reader)
+            if isinstance(asset, Audio):
+                asset.save()
+            if isinstance(asset, Mesh) and self.mesh_sidecars:
+                asset.save_sidecar()
+            if isinstance(asset, Mesh) and asset.post_process_report:
+                print('\t{} ACMR {acmr_before:.3f} -> {acmr_after:.3f}, '
+                      'vertices {vertices_before} -> {vertices_after}'.format(asset, **asset.post_process_report))
+            entry.asset = asset
+            entry.chunk_name = asset.chunk_name
+            entry.name = str(asset.name)
+            entry.header = asset.header()
+        return entry.asset
+
+    @contextlib.contextmanager
+    def texture_jobs(self):
+        """Textures loaded inside the block are saved on the texture pool, waits for all of them on exit"""
+        if self.texture_pool is not None or not self.texture_workers:
+            yield
+            return
+        self.texture_pool = JobPool(self.texture_workers)
+        try:
+            yield
+        finally:
+            pool, self.texture_pool = self.texture_pool, None
+            pool.close()
+
+    def archive_key(self):
+        """Archive size, mtime and a hash of its header, identifies the archive an index was built from"""
+        stat = self.path.stat()
+        with self.reader.save_current_pos():
+            self.reader.seek(0)
+            head = bytes(self.reader.read_bytes(INDEX_HASHED_BYTES))
+        return stat.st_size, stat.st_mtime_ns, hashlib.blake2b(head, digest_size=16).digest()
+
+    def save_index(self):
+        """Write the table of contents to a binary sidecar in the dump folder"""
+        size, mtime, digest = self.archive_key()
+        writer = ByteIO(path=self.index_path, mode='w')
+        writer.write_bytes(INDEX_MAGIC)
+        writer.write_uint32(INDEX_VERSION)
+        writer.write_uint64(size)
+        writer.write_uint64(mtime)
+        writer.write_bytes(digest)
+        for string in (self.model_name, self.model_name2, self.copyright):
+            writer.write_bytes(string.encode('latin-1') + b'\x00')
+        writer.write_uint32(len(self.toc))
+        kinds = list(ASSET_KINDS)
+        for entry in self.toc:
+            header_fields = ASSET_KINDS[entry.kind][0].HEADER_FIELDS
+            writer.write_uint8(kinds.index(entry.kind))
+            writer.write_bytes(bytes(entry.flag))
+            writer.write_uint32(entry.offset)
+            writer.write_uint32(entry.size)
+            for field in range(INDEX_HEADER_FIELDS):
+                writer.write_int32(entry.header.get(header_fields[field], 0) if field < len(header_fields) else 0)
+            writer.write_bytes(entry.chunk_name.encode('latin-1') + b'\x00')
+            writer.write_bytes(entry.name.encode('latin-1') + b'\x00')
+        writer.close()
+
+    def load_index(self) -> bool:
+        """Restore the table of contents from the sidecar, returns False when it is missing or stale"""
+        if not self.index_path.exists():
+            return False
+        reader = ByteIO(path=self.index_path)
+        try:
+            if bytes(reader.read_bytes(4)) != INDEX_MAGIC or reader.read_uint32() != INDEX_VERSION:
+                return False
+            key = reader.read_uint64(), reader.read_uint64(), bytes(reader.read_bytes(16))
+            if key != self.archive_key():
+                return False
+            model_name, model_name2, copyright = (reader.read_ascii_string() for _ in range(3))
+            kinds = list(ASSET_KINDS)
+            toc = []
+            for _ in range(reader.read_uint32()):
+                kind = kinds[reader.read_uint8()]
+                flag = reader.read_fmt('BBBB')
+                entry = AssetEntry(kind, flag, reader.read_uint32())
+                entry.size = reader.read_uint32()
+                values = reader.read_fmt('i' * INDEX_HEADER_FIELDS)
+                entry.header = dict(zip(ASSET_KINDS[kind][0].HEADER_FIELDS, values))
+                entry.chunk_name = reader.read_ascii_string()
+                entry.name = reader.read_ascii_string()
+                toc.append(entry)
+        except (struct.error, IndexError, ValueError):
+            return False
+        self.model_name, self.model_name2, self.copyright = model_name, model_name2, copyright
+        self.magic = 'RPK'
+        self.toc = toc
+        return True
+
+    def hash_range(self, offset: int, size: int) -> str:
+        with self.reader.save_current_pos():
+            self.reader.seek(offset)
+            return hashlib.blake2b(self.reader.read_bytes(size), digest_size=16).hexdigest()
+
+    def entry_hash(self, entry: AssetEntry) -> str:
+        """Hash of the asset bytes from its flag up to the next asset, offsets inside are relative so
+        an asset that only moved keeps its hash"""
+        return self.hash_range(entry.offset - 4, entry.size + 4)
+
+    def load_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with self.manifest_path.open('r') as fp:
+                manifest = json.load(fp)
+        except ValueError:
+            return {}
+        return manifest if manifest.get('version') == MANIFEST_VERSION else {}
+
+    def extract_options(self, asset_filter: Optional[AssetFilter]) -> dict:
+        """Options that change the extracted files, a manifest written with other options is not reused"""
+        return {'filter': asset_filter.to_json() if asset_filter else None, 'texture_format': self.texture_format,
+                'mip_level': self.mip_level, 'max_texture_size': self.max_texture_size,
+                'texture_store': str(self.texture_store) if self.texture_store is not None else None,
+                'mesh_attributes': sorted(self.mesh_attributes) if self.mesh_attributes is not None else None,
+                'triangulate': self.triangulate, 'optimize_meshes': self.optimize_meshes,
+                'export_glb': self.export_glb, 'compact_json': self.compact_json, 'mesh_sidecars': self.mesh_sidecars}
+
+    def save_manifest(self, source: dict, assets: Dict[str, Dict[str, str]], asset_filter: Optional[AssetFilter]):
+        manifest = {'version': MANIFEST_VERSION, 'source': source, 'assets': assets,
+                    'options': self.extract_options(asset_filter)}
+        with self.manifest_path.open('w') as fp:
+            json.dump(manifest, fp, indent=1)
+
+    def update(self, asset_filter: Optional[AssetFilter] = None) -> Optional[List[AssetEntry]]:
+        """
+        Incremental read + save, driven by the manifest of the previous run.
+        Returns None when the archive did not change since then and nothing was written, otherwise the entries
+        that were decoded again: new assets and assets whose bytes changed. The others keep their textures
+        and audio files and their model.json data.
+        """
+        manifest = self.load_manifest()
+        model_json = self.dump_path / 'model.json'
+        stat = self.path.stat()
+        source = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        old_source = manifest.get('source', {})
+        if not model_json.exists() or manifest.get('options') != self.extract_options(asset_filter):
+            manifest = {}
+        elif old_source.get('size') == source['size'] and old_source.get('mtime') == source['mtime']:
+            return None
+        source['hash'] = self.hash_range(0, stat.st_size)
+        if manifest and old_source.get('hash') == source['hash']:
+            self.save_manifest(source, manifest['assets'], asset_filter)  # touched only
+            return None
+
+        self.read(lazy=True, asset_filter=asset_filter)
+        old_assets = manifest.get('assets', {})
+        old_data = {}
+        if manifest:
+            with model_json.open('r') as fp:
+                old_data = json.load(fp)
+        assets = {kind: {} for kind in ASSET_KINDS}
+        unchanged = set()
+        for entry in self.toc:
+            digest = self.entry_hash(entry)
+            if old_assets.get(entry.kind, {}).get(entry.chunk_name) == digest:
+                unchanged.add(id(entry))
+            assets[entry.kind][entry.chunk_name] = digest
+        decoded = []
+        with self.texture_jobs():
+            for entry in self.toc:
+                if id(entry) not in unchanged:
+                    self.load(entry)
+                    decoded.append(entry)
+
+        def section(kind):
+            old_section = old_data.get(ASSET_KINDS[kind][1], {})
+            for entry in self.toc:
+                if entry.kind != kind:
+                    continue
+                if id(entry) in unchanged and entry.chunk_name in old_section:
+                    yield entry.chunk_name, old_section[entry.chunk_name]
+                else:
+                    yield entry.chunk_name, asset_json(self.load(entry), self.compact_json)
+
+        self.save({ASSET_KINDS[kind][1]: section(kind) for kind in ('model', 'mesh', 'texture', 'material')})
+        self.save_manifest(source, assets, asset_filter)
+        return decoded
+
+    def read(self, lazy=False, use_index=True, asset_filter: Optional[AssetFilter] = None):
+        """
+        :param lazy: only build the table of contents, assets are decoded when first accessed
+        :param use_index: load the table of contents from the sidecar index when it is up to date,
+         otherwise (re)write it after reading
+        :param asset_filter: assets it rejects are skipped right after their flag, they are not parsed,
+         decoded or listed. The index is not written for a filtered read
+        """
+        if not asset_filter:
+            asset_filter = None
+        if lazy and use_index and self.load_index():
+            if asset_filter is not None:
+                self.toc = [entry for entry in self.toc
+                            if asset_filter.match(entry.kind, entry.chunk_name, entry.name)]
+            self._make_asset_lists()
+            self._build_lookup()
+            return
+        with self.texture_jobs():
+            self._read_archive(lazy, asset_filter)
+        if use_index and asset_filter is None:
+            self.save_index()
+        if lazy:
+            self._make_asset_lists()
+        self._build_lookup()
 
-    def read(self):
+    def _read_archive(self, lazy: bool, asset_filter: Optional[AssetFilter]):
         reader = self.reader
         self.magic = reader.read_fourcc()
         assert self.magic == 'RPK'
@@ -64,55 +452,149 @@ class PRP:
                 item.seek_to()
                 reader.skip(3)
                 items2 = reader.get_items()
+                # an asset spans up to the flag of the next one, skipped and unknown ones included
+                starts = sorted(int(offset) for offset in items2.offsets)
+                ends = dict(zip(starts, starts[1:] + [reader.size()]))
                 for item2 in items2:
                     reader.seek(item2.offset)
                     # flag = reader.read_int32()
                     flag = reader.read_fmt('BBBB')
-                    if flag in [(61, 0, 65, 0), (153, 0, 65, 0), (152, 0, 65, 0)]:
-                        print('Found texture, reading it')
-                        tex = Texture(self.dump_path)
-                        tex.read(reader)
-                        print('\tTexture "{}" {}x{}\n'.format(tex.name,tex.width,tex.height))
-                        self.textures.append(tex)
-
-                    elif flag == (53, 0, 65, 0):
-                        print('Found Mesh, reading it')
-                        mesh = Mesh(self.dump_path)
-                        mesh.read(reader)
-                        print('\tMesh "{}"\n'.format(mesh.name))
-                        self.meshes.append(mesh)
-                    elif flag in [(82, 6, 65, 0), (60, 6, 65, 0), (36, 6, 65, 0), (10, 6, 65, 0), (15, 6, 65, 0),
-                                  (8, 6, 65, 0),
-                                  (54, 6, 65, 0), (38, 6, 65, 0), (18, 6, 65, 0), (22, 6, 65, 0), (32, 6, 65, 0)]:
-                        print('Found material, reading it')
-                        mat = Material(self.dump_path)
-                        mat.read(reader)
-                        print('\tMaterial "{}"\n'.format(mat.name))
-                        self.materials.append(mat)
-
-                    elif flag in [(75, 0, 65, 0)]:
-                        print('Found Model, reading it')
-                        mdl = Model(self.dump_path)
-                        mdl.read(reader)
-                        print('\tModel "{}" bones:{}\n'.format(mdl.name,mdl.bone_count))
-                        self.models.append(mdl)
-                    elif flag == (5, 0, 65, 0):
-                        print('Found Animation, reading it')
-                        anim = Animation(self.dump_path)
-                        anim.read(reader)
-                        self.animation.append(anim)
-                    elif flag == (0, 0, 161, 0):
-                        print('Found Audio, reading it')
-                        audio = Audio(self.dump_path)
-                        audio.read(reader)
-                        print('\tAudio "{}"\n'.format(audio.name))
-                        audio.save()
-                        self.audio.append(audio)
-                    else:
-                        print('Found new flag',flag)
-
-
-class Animation:
+                    kind = FLAG_KINDS.get(flag)
+                    if kind is None:
+                        print('Found new flag', flag)
+                        continue
+                    entry = AssetEntry(kind, flag, reader.tell())
+                    entry.size = ends[item2.offset] - entry.offset
+                    if asset_filter is not None:
+                        if not asset_filter.match_kind(kind):
+                            continue
+                        if asset_filter.needs_names:
+                            with reader.save_current_pos():
+                                Asset.HEADER_SCHEMA(reader, entry)
+                            if not asset_filter.match(kind, entry.chunk_name, entry.name):
+                                continue
+                    self.toc.append(entry)
+                    if lazy:
+                        asset = ASSET_KINDS[kind][0](self.dump_path)
+                        asset.read_header(reader)
+                        entry.chunk_name = asset.chunk_name
+                        entry.name = str(asset.name)
+                        entry.header = asset.header()
+                        continue
+                    print('Found {}, reading it'.format(kind))
+                    asset = self.load(entry)
+                    print('\t{}\n'.format(asset))
+                    getattr(self, ASSET_KINDS[kind][1]).append(asset)
+
+    def _make_asset_lists(self):
+        for kind, (_, attr) in ASSET_KINDS.items():
+            setattr(self, attr, AssetList(self, [entry for entry in self.toc if entry.kind == kind]))
+
+    def _build_lookup(self):
+        self.chunk_index = {(entry.kind, entry.chunk_name): entry for entry in self.toc}
+        self.name_index = {(entry.kind, entry.name): entry for entry in self.toc}
+
+    def find_entry(self, kind: str, key: str) -> Optional[AssetEntry]:
+        entry = self.chunk_index.get((kind, key))
+        if entry is None:
+            entry = self.name_index.get((kind, key))
+        return entry
+
+    def get_asset(self, kind: str, key: str):
+        """Asset of kind by chunk name or display name, decoded on demand, None if the archive has none"""
+        entry = self.find_entry(kind, key)
+        if entry is None:
+            return None
+        return self.load(entry)
+
+    def entry_end(self, entry: AssetEntry) -> int:
+        """End of the bytes of an asset, the archive size when its span is not known"""
+        return entry.offset + entry.size if entry.size else self.reader.size()
+
+    def texture_header(self, key: str) -> Optional['Texture']:
+        """Texture with only its header read, nothing is decoded or written"""
+        entry = self.find_entry('texture', key)
+        if entry is None:
+            return None
+        texture = Texture(self.dump_path)
+        texture.mip_level = self.mip_level
+        texture.max_size = self.max_texture_size
+        texture.data_end = self.entry_end(entry)  # the data chunk's own end when other chunks follow it
+        with self.reader.save_current_pos():
+            self.reader.seek(entry.offset)
+            texture.read_header(self.reader)
+        texture.mip_count = texture.count_mips(texture.data_end)
+        return texture
+
+    def texture_pixels(self, key: str, level: Optional[int] = None) -> Optional[np.ndarray]:
+        """(height, width, 4) RGBA pixels of a texture by chunk name or name, None if the archive has none"""
+        texture = self.texture_header(key)
+        if texture is None:
+            return None
+        return texture.pixels(self.reader, level)
+
+    def texture_pixels_batch(self, keys: List[str], level: Optional[int] = None) -> List[np.ndarray]:
+        """Pixels of several textures, all levels are read before decoding, see decode_bcn_batch"""
+        images = []
+        for key in keys:
+            texture = self.texture_header(key)
+            if texture is None:
+                raise KeyError(key)
+            texture_level = texture.export_level() if level is None else level
+            images.append((texture.read_level(self.reader, texture_level), *texture.mip_size(texture_level),
+                           texture.format))
+        return decode_bcn_batch(images)
+
+    def get_texture(self, key: str) -> Optional['Texture']:
+        return self.get_asset('texture', key)
+
+    def get_mesh(self, key: str) -> Optional['Mesh']:
+        return self.get_asset('mesh', key)
+
+    def get_material(self, key: str) -> Optional['Material']:
+        return self.get_asset('material', key)
+
+    def get_model(self, key: str) -> Optional['Model']:
+        return self.get_asset('model', key)
+
+    def resolve_model(self, model) -> List['SubMesh']:
+        """Meshes of a model with their material, textures and bone map, decodes only the referenced assets"""
+        if isinstance(model, str):
+            model = self.get_model(model)
+        sub_meshes = []
+        for n, (mesh_chunk, mat_chunk) in enumerate(model.model_data):
+            material = self.get_material(mat_chunk)
+            textures = {}
+            if material is not None:
+                for slot in Material.TEXTURE_SLOTS:
+                    texture = self.get_texture(getattr(material, slot)) if getattr(material, slot) else None
+                    if texture is not None:
+                        textures[slot] = texture
+            bone_map = model.bone_map_list[n] if n < len(model.bone_map_list) else None
+            sub_meshes.append(SubMesh(self.get_mesh(mesh_chunk), material, textures, bone_map))
+        return sub_meshes
+
+
+NAMES = {20: Field('chunk_name', STRING), 21: Field('name', STRING)}
+
+
+class Asset:
+    FLAGS = set()  # asset flags of the type 26 list handled by this class
+    HEADER_FIELDS = ()  # attributes read by read_header and kept in the table of contents
+    HEADER_SCHEMA = compile_schema(Chunk(NAMES))
+    SCHEMA = HEADER_SCHEMA
+
+    def read_header(self, reader: ByteIO):
+        self.HEADER_SCHEMA(reader, self)
+
+    def read(self, reader: ByteIO):
+        self.SCHEMA(reader, self)
+
+    def header(self):
+        return {field: getattr(self, field) or 0 for field in self.HEADER_FIELDS}
+
+
+class Animation(Asset):
 
     def __init__(self, path: Path):
         self.path = path
@@ -123,80 +605,43 @@ class Animation:
         self.frame_offset = 0
         self.frame_count2 = 0
         self.frame_offset2 = 0
-        self.anim_data = []
-        self.anim_data2 = []
-        self.anim_data3 = []
-    def read(self, reader: ByteIO):
-        items = reader.get_items()
-        for item in items:
-            item.seek_to()
+        # one (frame_count, frame_size) uint8 array per bone track
+        self.anim_data = []  # type: List[np.ndarray]
+        self.anim_data2 = []  # type: List[np.ndarray]
+        self.anim_data3 = []  # type: List[np.ndarray]
 
-            if item.type == 20:
-                self.chunk_name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 21:
-                self.name = reader.read_ascii_string(reader.read_int32())
-                print(self.name)
-            if item.type == 1:
-                items2 = item.get_items()
-                for item2 in items2:
-                    item2.seek_to()
-                    if item2.type == 10:
-                        reader.skip(3)
-                        items4 = item2.get_items()
-                        for item4 in items4:
-                            item4.seek_to()
-                            flag = reader.read_fmt('BBBB')
-                            print(flag)
-                            if flag == (7, 0, 65, 0): #bone
-                                items5 = item4.get_items()
-                                for item5 in items5:
-                                    print(item5)
-                                    item5.seek_to()
-
-                                    if item5.type == 20:
-                                        b_name = reader.read_ascii_string(reader.read_int32())
-                                        print('\t',b_name)
-                                        self.bone_names.append(b_name)
-                                    if item5.type == 24:
-                                        items6 = item5.get_items()
-                                        for item6 in items6:
-                                            item6.seek_to()
-                                            if item6.type == 21:
-                                                self.frame_count = reader.read_uint32()
-                                            if item6.type == 22:
-                                                self.frame_offset = reader.tell()
-                                        if self.frame_offset and self.frame_count:
-                                            for _ in range(self.frame_count):
-                                                self.anim_data.append(reader.read_bytes(16))
-
-                                    if item5.type == 25:
-                                        items6 = item5.get_items()
-                                        for item6 in items6:
-                                            item6.seek_to()
-                                            if item6.type == 21:
-                                                items7 = item5.get_items()
-                                                for item7 in items7:
-                                                    item7.seek_to()
-                                                    if item7.type == 22:
-                                                        self.frame_count = reader.read_uint32()
-                                                    if item7.type == 23:
-                                                        self.frame_offset = reader.tell()
-                                                    if item7.type == 30:
-                                                        self.frame_count2 = reader.read_uint32()
-                                                    if item7.type == 31:
-                                                        self.frame_offset2 = reader.tell()
-
-                                        if self.frame_offset and self.frame_count:
-                                            reader.seek(self.frame_offset)
-                                            for _ in range(self.frame_count):
-                                                self.anim_data2.append(reader.read_bytes(6))
-                                        if self.frame_offset2 and self.frame_count2:
-                                            reader.seek(self.frame_offset2)
-                                            for _ in range(self.frame_count2):
-                                                self.anim_data3.append(reader.read_bytes(8))
-
-
-class Audio:
+    def __repr__(self):
+        return '<Animation "{}" bones:{}>'.format(self.name, len(self.bone_names))
+
+    def _read_track(self, reader: ByteIO, _):
+        if self.frame_offset and self.frame_count:
+            reader.seek(self.frame_offset)
+            self.anim_data.append(reader.read_array(FRAME16, self.frame_count))
+
+    def _read_packed_tracks(self, reader: ByteIO, _):
+        if self.frame_offset and self.frame_count:
+            reader.seek(self.frame_offset)
+            self.anim_data2.append(reader.read_array(FRAME6, self.frame_count))
+        if self.frame_offset2 and self.frame_count2:
+            reader.seek(self.frame_offset2)
+            self.anim_data3.append(reader.read_array(FRAME8, self.frame_count2))
+
+    FLAGS = {(5, 0, 65, 0)}
+    SCHEMA = compile_schema(Chunk({
+        **NAMES,
+        1: Chunk({
+            10: Chunk(skip=3, each=Chunk(flag=(7, 0, 65, 0), fields={  # bone
+                20: Field('bone_names', STRING, append=True),
+                24: Chunk({21: Field('frame_count', UINT32), 22: Field('frame_offset', OFFSET)}, then=_read_track),
+                25: Chunk({21: Chunk({22: Field('frame_count', UINT32), 23: Field('frame_offset', OFFSET),
+                                      30: Field('frame_count2', UINT32), 31: Field('frame_offset2', OFFSET)})},
+                          then=_read_packed_tracks),
+            })),
+        }),
+    }))
+
+
+class Audio(Asset):
 
     def __init__(self, path: Path):
         self.path = path
@@ -204,29 +649,23 @@ class Audio:
         self.name = ''
         self.temp_path = ''
         self.size = 0
+        self.data_offset = 0
         self.data = b''
 
-    def read(self, reader: ByteIO):
-        items = reader.get_items()
-        for item in items:
-            item.seek_to()
+    def __repr__(self):
+        return '<Audio "{}">'.format(self.name)
 
-            if item.type == 20:
-                self.chunk_name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 21:
-                self.name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 100:
-                self.temp_path = reader.read_ascii_string(reader.read_int32())
+    def _read_data(self, reader: ByteIO, _):
+        if self.data_offset:
+            reader.seek(self.data_offset)
+            self.data = bytes(reader.read_bytes(self.size))  # a copy, does not pin the archive mapping
 
-            if item.type == 1:
-                items2 = item.get_items()
-                for item2 in items2:
-                    item2.seek_to()
-                    if item2.type == 30:
-                        item2.seek_to()
-                        self.size = reader.read_uint32()
-                    if item2.type == 31:
-                        self.data = reader.read_bytes(self.size)
+    FLAGS = {(0, 0, 161, 0)}
+    SCHEMA = compile_schema(Chunk({
+        **NAMES,
+        100: Field('temp_path', STRING),
+        1: Chunk({30: Field('size', UINT32), 31: Field('data_offset', OFFSET)}, then=_read_data),
+    }))
 
     def save(self):
         path = self.path
@@ -235,7 +674,21 @@ class Audio:
         with (path/(self.name+'.wav')).open('wb') as fp:
             fp.write(self.data)
 
-class Texture:
+class Texture(Asset):
+    FLAGS = {(61, 0, 65, 0), (153, 0, 65, 0), (152, 0, 65, 0)}
+    HEADER_FIELDS = ('width', 'height', 'format')
+    HEADER_SCHEMA = compile_schema(Chunk({
+        20: Field('chunk_name', STRING),
+        21: Field('name', PATH),
+        1: Chunk({
+            20: Chunk(skip=3, limit=1, each=Chunk(flag=(36, 0, 65, 0), fields={
+                20: Field('width', INT32),
+                21: Field('height', INT32),
+                23: Field('format', INT32),
+                22: Field('offset', OFFSET),
+            }, ends={22: 'data_end'})),
+        }),
+    }))
 
     def __init__(self, path: Path):
         self.path = path
@@ -245,64 +698,122 @@ class Texture:
         self.format = 0
         self.height = 0
         self.offset = 0
+        self.export_format = 'tga'  # or 'dds', raw BCn blocks without decoding
+        self.mip_level = 0  # mip level to export
+        self.max_size = 0  # when set, smaller mip levels are exported until width and height fit
+        self.mip_count = 0  # levels available in the archive, the chain follows the top level down to 1x1
+        self.data_end = 0  # end of the data chunk (or of the asset), mip levels past it are not in the archive
+        self.jobs = None  # type: Optional[JobPool]
+        self.store = None  # type: Optional[Path]
+        self.store_key = ''  # hash of the exported blocks when saved to the shared store
+
+    def __repr__(self):
+        return '<Texture "{}" {}x{}>'.format(self.name, self.width, self.height)
+
+    @property
+    def file_path(self) -> Path:
+        if self.store_key:
+            return self.store / (self.store_key + '.' + self.export_format)
+        return self.path / 'textures' / self.name.with_name(self.name.stem).with_suffix('.' + self.export_format)
 
     def to_json(self):
         data = {
             'name': str(self.name), 'w': self.width, 'h': self.height,
-            'path': str(self.path / 'textures' / self.name.with_name(self.name.stem).with_suffix('.tga'))
+            'path': str(self.file_path)
         }
         return data
 
+    def mip_size(self, level: int) -> Tuple[int, int]:
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+    def mip_span(self, level: int) -> Tuple[int, int]:
+        """Offset and byte size of a mip level"""
+        block_size = BCN_FORMATS[self.format][1]
+        offset = self.offset
+        for n in range(level):
+            offset += level_size(*self.mip_size(n), block_size)
+        return offset, level_size(*self.mip_size(level), block_size)
+
+    def count_mips(self, data_end: int) -> int:
+        """Levels of the full chain that fit before data_end, at least the top level"""
+        if self.format not in BCN_FORMATS:
+            return 1  # reading the level raises NotImplementedError
+        end = self.offset
+        for level in range(max(self.width, self.height, 1).bit_length()):
+            end += level_size(*self.mip_size(level), BCN_FORMATS[self.format][1])
+            if end > data_end:
+                return max(level, 1)
+        return max(self.width, self.height, 1).bit_length()
+
+    def export_level(self) -> int:
+        level = min(self.mip_level, self.mip_count - 1)
+        if self.max_size:
+            while level < self.mip_count - 1 and max(self.mip_size(level)) > self.max_size:
+                level += 1
+        return level
+
+    @staticmethod
+    def save_dds(width: int, height: int, texture_format: int, data, path: Path):
+        os.makedirs(path.parent, exist_ok=True)
+        with path.open('wb') as fp:
+            fp.write(dds_header(width, height, BCN_FORMATS[texture_format][2], len(data)))
+            fp.write(data)
+
+    @staticmethod
+    def save_tga(width: int, height: int, texture_format: int, data, path: Path):
+        image = Image.frombuffer('RGBA', (width, height), data, 'bcn', BCN_FORMATS[texture_format][0])
+        os.makedirs(path.parent, exist_ok=True)
+        image.save(path)
+
+    @staticmethod
+    def save_shared(save, width: int, height: int, texture_format: int, data, path: Path):
+        """save to a temporary file renamed into place, other archives may save the same texture meanwhile"""
+        temp_path = path.with_name('{}.{}-{}.tmp{}'.format(path.stem, os.getpid(), threading.get_ident(), path.suffix))
+        save(width, height, texture_format, data, temp_path)
+        os.replace(temp_path, path)
+
+    def read_level(self, reader: ByteIO, level: int):
+        """Compressed blocks of a mip level, a view of the archive when it is memory mapped"""
+        if self.format not in BCN_FORMATS:
+            raise NotImplementedError('Format:{} is not supported yet'.format(self.format))
+        offset, size = self.mip_span(level)
+        with reader.save_current_pos():
+            reader.seek(offset)
+            return reader.read_bytes(size)
+
+    def pixels(self, reader: ByteIO, level: Optional[int] = None) -> np.ndarray:
+        """Decoded (height, width, 4) RGBA pixels of a mip level, export_level() by default, no file is written"""
+        level = self.export_level() if level is None else level
+        return decode_bcn(self.read_level(reader, level), *self.mip_size(level), self.format)
+
     def read(self, reader: ByteIO):
-        header_chunks = reader.get_items()
-        for tex_chunk in header_chunks:
-            reader.seek(tex_chunk.offset)
-            if tex_chunk.type == 20:
-                self.chunk_name = reader.read_ascii_string(reader.read_int32())
-            if tex_chunk.type == 21:
-                self.name = Path(reader.read_ascii_string(reader.read_int32()))
-            if tex_chunk.type == 1:
-                texture_data_chunks = reader.get_items()
-                for tex_data in texture_data_chunks:
-                    reader.seek(tex_data.offset)
-                    if tex_data.type == 20:
-                        reader.skip(3)
-                        items3 = reader.get_items()[:1]
-                        for n, item3 in enumerate(items3):
-                            reader.seek(item3.offset)
-                            flag = reader.read_fmt('BBBB')
-                            if flag == (36, 0, 65, 0):
-                                items4 = reader.get_items()
-                                for item4 in items4:
-                                    reader.seek(item4.offset)
-                                    if item4.type == 20:
-                                        self.width = reader.read_int32()
-                                    if item4.type == 21:
-                                        self.height = reader.read_int32()
-                                    if item4.type == 23:
-                                        self.format = reader.read_int32()
-                                    if item4.type == 22:
-                                        self.offset = reader.tell()
-                                reader.seek(self.offset)
-                                if self.format == 7:
-                                    pixel_mode = ('bcn', 1, 0)
-                                elif self.format == 11:
-                                    pixel_mode = ('bcn', 3, 0)
-                                elif self.format == 9:
-                                    pixel_mode = ('bcn', 2, 0)
-                                # elif self.format == 5:
-                                #     pixel_mode = ('bcn', 7, 0)
-                                else:
-                                    raise NotImplementedError('Format:{} is not supported yet'.format(self.format))
-                                im_data = reader.read_bytes(self.width * self.height * 4)
-                                image = Image.frombuffer('RGBA', (self.width, self.height), im_data, *pixel_mode)
-                                del im_data
-                                tex_path = self.path / 'textures'
-                                os.makedirs(tex_path, exist_ok=True)
-                                image.save(tex_path / self.name.with_name(self.name.stem).with_suffix('.tga'))
-
-
-class Mesh:
+        self.read_header(reader)
+        if not self.offset:
+            return
+        if self.format not in BCN_FORMATS:
+            raise NotImplementedError('Format:{} is not supported yet'.format(self.format))
+        self.mip_count = self.count_mips(self.data_end or reader.size())
+        level = self.export_level()
+        # the pool is drained before the reader goes away
+        data = self.read_level(reader, level)
+        save = self.save_dds if self.export_format == 'dds' else self.save_tga
+        if self.store is not None:
+            key = hashlib.blake2b(struct.pack('<3i', self.format, *self.mip_size(level)), digest_size=16)
+            key.update(data)
+            self.store_key = key.hexdigest()
+            if self.file_path.exists():
+                return
+            save = functools.partial(self.save_shared, save)
+        job = (*self.mip_size(level), self.format, data, self.file_path)
+        if self.jobs is not None:
+            self.jobs.submit(save, *job)
+        else:
+            save(*job)
+
+
+class Mesh(Asset):
+    FLAGS = {(53, 0, 65, 0)}
+    HEADER_FIELDS = ('vert_count', 'indices_count', 'mode')
 
     def __init__(self, path: Path):
         self.path = path
@@ -310,7 +821,7 @@ class Mesh:
         self.name = ''
         self.indices_count = None
         self.indices_offset = 0
-        self.indices = []
+        self.indices = np.empty(0, np.uint16)  # type: np.ndarray
         self.mode = 0  # 0 - NONE,1 - triangles, 2 - triangle strip
         self.vert_stride = 0
         self.vert_count = 0
@@ -321,122 +832,190 @@ class Mesh:
         self.uv_offset = None
         self.skin_ind_offset = None
         self.skin_weight_offset = None
-        self.vertices = []
-        self.uv = []
-        self.weight_inds = []
-        self.weight_weight = []
-        ...
+        self.vertices = np.empty((0, 3), np.float32)  # type: np.ndarray
+        self.uv = np.empty((0, 2), np.float64)  # type: np.ndarray
+        self.weight_inds = np.empty((0, 2), np.uint8)  # type: np.ndarray
+        self.weight_weight = np.empty((0, 2), np.uint8)  # type: np.ndarray
+        self.layout = None  # type: Optional[VertexLayout]
+        self.attributes = None  # vertex attributes to decode, see VertexLayout, None decodes all of them
+        self.vertex_data = {}  # type: Dict[str, np.ndarray]
+        self.triangulate = False  # store strips as triangle lists (mode 1)
+        self.triangulated = False  # indices were converted to a triangle list here, json marks them 'triangulated'
+        self.post_process = False  # run optimize after reading
+        self.post_process_report = {}  # type: Dict[str, float]
+        self.sidecar = ''  # .npz with the geometry, relative to the dump folder
+        self.raw_header = {}  # header() as read, before the mesh was converted
 
-    def to_json(self):
+    def __repr__(self):
+        return '<Mesh "{}">'.format(self.name)
+
+    def to_json(self, arrays=False):
+        """:param arrays: keep numpy arrays, for JsonStream's packed arrays"""
+        if self.sidecar:
+            return self._mark_triangulated({'name': self.name, 'mode': self.mode, 'sidecar': self.sidecar})
+        array = (lambda a: a) if arrays else (lambda a: a.tolist())
         verts = {
-            'pos': self.vertices,
-            'uv': self.uv,
+            'pos': array(self.vertices),
+            'uv': array(self.uv),
             'weight': {
-                'bone': self.weight_inds,
-                'weight': self.weight_weight
+                'bone': array(self.weight_inds),
+                'weight': array(self.weight_weight)
             }
         }
-        data = {'indices': self.indices, 'name': self.name, 'vertices': verts, 'mode': self.mode}
+        for name, data in self._extra_attributes():
+            verts[name] = array(data)
+        data = {'indices': array(self.indices), 'name': self.name, 'vertices': verts, 'mode': self.mode}
+        return self._mark_triangulated(data)
+
+    def _mark_triangulated(self, data):
+        # the importer treats mode 1 indices of the archive as strips too, only converted ones are lists
+        if self.triangulated:
+            data['triangulated'] = True
         return data
 
+    def _extra_attributes(self):
+        """Decoded attributes besides position, uv and skin, extra uv sets flipped like uv"""
+        for name, data in self.vertex_data.items():
+            if name not in ('pos', 'uv', 'skin_ind', 'skin_weight'):
+                yield name, flip_uv(data) if name.startswith('uv') else data
+
+    def save_sidecar(self):
+        """
+        Write the geometry to meshes/<chunk name>.npz in the dump folder: indices, pos, uv, weight_bone,
+        weight_weight and the extra attributes, the arrays of to_json. to_json then only references the file
+        """
+        arrays = {'indices': self.indices, 'pos': self.vertices, 'uv': self.uv,
+                  'weight_bone': self.weight_inds, 'weight_weight': self.weight_weight}
+        arrays.update(self._extra_attributes())
+        file_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in self.chunk_name) + '.npz'
+        os.makedirs(self.path / 'meshes', exist_ok=True)
+        np.savez(str(self.path / 'meshes' / file_name), **arrays)
+        self.sidecar = 'meshes/' + file_name
+
+    def _triangle_list(self, reader: ByteIO, _):
+        if self.indices_count is not None:
+            self.mode = 1
+
+    def _triangle_strip(self, reader: ByteIO, _):
+        if self.indices_count is not None:
+            self.mode = 2
+
+    def _read_vertex_declaration(self, reader: ByteIO, _):
+        reader.seek(self.vert_offset)
+        # (usage index, ?, usage, type) per element
+        self.layout = compile_layout(reader.read_array(np.uint8, self.vert_item_count * 4).reshape(-1, 4).tolist())
+        self.pos_offset = self.layout.offset('pos')
+        self.uv_offset = self.layout.offset('uv')
+        self.skin_ind_offset = self.layout.offset('skin_ind')
+        self.skin_weight_offset = self.layout.offset('skin_weight')
+
+    INDICES = {21: Field('indices_count', INT32), 22: Field('indices_offset', OFFSET)}
+    HEADER_SCHEMA = compile_schema(Chunk({
+        **NAMES,
+        1: Chunk({
+            10: Chunk(INDICES, then=_triangle_list),
+            21: Chunk(INDICES, then=_triangle_strip),
+            11: Chunk({
+                20: Chunk({21: Field('vert_stride', INT32), 22: Field('vert_item_count', INT32),
+                           23: Field('vert_offset', OFFSET)}, then=_read_vertex_declaration),
+                21: Field('vert_count', INT32),
+                22: Field('stream_offset', OFFSET),
+            }),
+        }),
+    }))
+
+    def header(self):
+        # values of the archive, triangulate and optimize change mode and vert_count after reading
+        return self.raw_header or super().header()
+
     def read(self, reader: ByteIO):
-        header_chunks = reader.get_items()
-        for item in header_chunks:
-            reader.seek(item.offset)
-
-            if item.type == 20:
-                self.chunk_name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 21:
-                self.name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 1:
-                items = reader.get_items()
-                for item in items:
-                    reader.seek(item.offset)
-
-                    if item.type == 10:
-                        items2 = reader.get_items()
-                        for item2 in items2:
-                            reader.seek(item2.offset)
-                            if item2.type == 21:
-                                self.indices_count = reader.read_int32()
-                            if item2.type == 22:
-                                self.indices_offset = reader.tell()
-                        if self.indices_count is not None:
-                            self.mode = 1
-                            reader.seek(self.indices_offset)
-                            self.indices = [reader.read_uint16() for _ in range(self.indices_count)]
-
-                    if item.type == 21:
-                        items2 = reader.get_items()
-                        for item2 in items2:
-                            reader.seek(item2.offset)
-                            if item2.type == 21:
-                                self.indices_count = reader.read_int32()
-                            if item2.type == 22:
-                                self.indices_offset = reader.tell()
-                        if self.indices_count is not None:
-                            self.mode = 2
-                            reader.seek(self.indices_offset)
-                            self.indices = [reader.read_uint16() for _ in range(self.indices_count)]
-
-                    if item.type == 11:
-                        items2 = reader.get_items()
-                        for item2 in items2:
-                            reader.seek(item2.offset)
-                            if item2.type == 20:
-                                items3 = reader.get_items()
-                                for item3 in items3:
-                                    reader.seek(item3.offset)
-
-                                    if item3.type == 21:
-                                        self.vert_stride = reader.read_int32()
-                                    if item3.type == 22:
-                                        self.vert_item_count = reader.read_int32()
-                                    if item3.type == 23:
-                                        self.vert_offset = reader.tell()
-                                    reader.seek(self.vert_offset)
-                                off = 0
-                                for k in range(self.vert_item_count):
-                                    a, b, c, d = reader.read_fmt('BBBB')
-                                    # print k,a,b,c,d,vertStrideSize
-                                    if c == 1: self.pos_offset = off
-                                    if c == 5 and a == 0:
-                                        self.uv_offset = off
-                                    # print k,a,b,c,d,vertStrideSize
-                                    if c == 11: self.skin_ind_offset = off
-                                    if c == 10: self.skin_weight_offset = off
-                                    if d == 2: off += 12
-                                    if d == 1: off += 8
-                                    if d == 3: off += 16
-                                    if d == 4: off += 1
-                                    if d == 7: off += 1
-                                    if d == 15: off += 4
-                            if item2.type == 21:
-                                self.vert_count = reader.read_int32()
-                            if item2.type == 22:
-                                self.stream_offset = reader.tell()
+        self.read_header(reader)
+        self.raw_header = super().header()
+        if self.mode:
+            reader.seek(self.indices_offset)
+            self.indices = reader.read_array(np.uint16, self.indices_count)
+            if self.triangulate and self.mode == 2:
+                self.indices = strip_to_list(self.indices).ravel()
+                self.mode = 1
+                self.triangulated = True
+        if not self.vert_count or self.layout is None:
+            return
         reader.seek(self.stream_offset)
-        for k in range(self.vert_count):
-            tk = reader.tell()
-            if self.pos_offset is not None:
-                reader.seek(self.pos_offset + tk)
-                self.vertices.append(reader.read_fmt('fff'))
-            if self.uv_offset is not None:
-                reader.seek(self.uv_offset + tk)
-                self.uv.append([reader.read_float(), 1 - reader.read_float()])
-            if self.skin_ind_offset:
-                # reader.seek(self.skin_ind_offset + tk)
-                i1, i2, i3 = reader.read_fmt('BBB')
-                self.weight_inds.append([i1, i2])
-            if self.skin_weight_offset:
-                # reader.seek(self.skin_weight_offset + tk)
-                w1, w2 = reader.read_fmt('BB')
-                w3 = 255 - (w1 + w2)
-                self.weight_weight.append([w1, w2])
-            reader.seek(tk + self.vert_stride)
-
-
-class Material:
+        vertices = reader.read_records(self.layout.dtype(self.attributes), self.vert_count, self.vert_stride)
+        self.vertex_data = {name: vertices[name] for name in vertices.dtype.names}
+        self._set_columns()
+        if self.post_process and self.mode:
+            self.post_process_report = self.optimize()
+
+    def _set_columns(self):
+        if 'pos' in self.vertex_data:
+            self.vertices = self.vertex_data['pos'][:, :3]
+        if 'uv' in self.vertex_data:
+            self.uv = flip_uv(self.vertex_data['uv'])
+        if 'skin_ind' in self.vertex_data and 'skin_weight' in self.vertex_data:
+            self.weight_inds, self.weight_weight = self._skin_influences()
+
+    def triangles(self) -> np.ndarray:
+        """(N, 3) triangles of the index buffer, a strip unless it was triangulated here (same as the importer)"""
+        if not self.triangulated:
+            return strip_to_list(self.indices)
+        return self.indices[:len(self.indices) // 3 * 3].reshape(-1, 3)
+
+    def optimize(self, cache_size=16) -> Dict[str, float]:
+        """
+        Post processing for rendering: strips become a triangle list, vertices identical in every decoded attribute
+        are welded, triangles are reordered for the post-transform cache (tipsify) and vertices in order of first use.
+        Returns vertex counts and ACMR before and after.
+        """
+        triangles = self.triangles()
+        report = {'vertices_before': self.vert_count, 'acmr_before': acmr(triangles, cache_size)}
+        columns, triangles = weld(self.vertex_data, triangles)
+        vertex_count = max([len(column) for column in columns.values()] + [int(triangles.max(initial=-1)) + 1])
+        triangles = tipsify(triangles, vertex_count, cache_size)
+        order = fetch_order(triangles, vertex_count)
+        remap = np.zeros(vertex_count, np.int64)
+        remap[order] = np.arange(len(order))
+        triangles = remap[triangles]
+        self.vertex_data = {name: column[order] for name, column in columns.items()}
+        self.vert_count = len(order)
+        self.indices = triangles.ravel().astype(np.uint16 if len(order) <= 0x10000 else np.uint32)
+        self.mode = 1
+        self.triangulated = True
+        self._set_columns()
+        report.update(vertices_after=self.vert_count, triangles=len(triangles), acmr_after=acmr(triangles, cache_size))
+        return report
+
+    def _skin_influences(self):
+        """Bone indices and weights of equal width, a weight left out of the stream is 255 minus the others"""
+        indices = self.vertex_data['skin_ind']
+        weights = self.vertex_data['skin_weight']
+        if weights.shape[1] < indices.shape[1]:
+            implicit = np.clip(255 - weights.sum(1, dtype=np.int32), 0, 255).astype(np.uint8)
+            weights = np.concatenate((weights, implicit[:, None]), 1)
+        influences = min(indices.shape[1], weights.shape[1])
+        return indices[:, :influences], weights[:, :influences]
+
+
+def flip_uv(uv: np.ndarray) -> np.ndarray:
+    """(u, 1 - v) in double precision"""
+    uv = uv[:, :2].astype(np.float64)
+    uv[:, 1] = 1 - uv[:, 1]
+    return uv
+
+
+class Material(Asset):
+    FLAGS = {(82, 6, 65, 0), (60, 6, 65, 0), (36, 6, 65, 0), (10, 6, 65, 0), (15, 6, 65, 0), (8, 6, 65, 0),
+             (54, 6, 65, 0), (38, 6, 65, 0), (18, 6, 65, 0), (22, 6, 65, 0), (32, 6, 65, 0)}
+    TEXTURE_SLOTS = ('diffuse', 'glow', 'normal', 'mask', 'something1')
+    SCHEMA = compile_schema(Chunk({
+        **NAMES,
+        30: Chunk({20: Field('diffuse', STRING)}),
+        32: Chunk({20: Field('glow', STRING)}),
+        42: Chunk({20: Field('normal', STRING)}),
+        50: Chunk({20: Field('normal', STRING)}),
+        44: Chunk({20: Field('mask', STRING)}),
+        49: Chunk({20: Field('something1', STRING)}),
+    }))
 
     def __init__(self, path: Path):
         self.path = path
@@ -450,6 +1029,9 @@ class Material:
         self.something2 = ''
         ...
 
+    def __repr__(self):
+        return '<Material "{}">'.format(self.name)
+
     def to_json(self):
         data = {
             'name': self.name, 'diffuse': self.diffuse, 'mask': self.mask, 'normal': self.normal, 'glow': self.glow,
@@ -457,44 +1039,18 @@ class Material:
         }
         return data
 
-    def read(self, reader: ByteIO):
-        items = reader.get_items()
-        for item in items:
-            reader.seek(item.offset)
-            if item.type == 20:
-                self.chunk_name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 21:
-                self.name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 30:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 20:
-                        self.diffuse = reader.read_ascii_string(reader.read_int32())
-            if item.type == 32:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 20:
-                        self.glow = reader.read_ascii_string(reader.read_int32())
-            if item.type == 42 or item.type == 50:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 20:
-                        self.normal = reader.read_ascii_string(reader.read_int32())
-            if item.type == 44:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 20:
-                        self.mask = reader.read_ascii_string(reader.read_int32())
-            if item.type == 49:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 20:
-                        self.something1 = reader.read_ascii_string(reader.read_int32())
+
+class SubMesh:
+    """One mesh/material pair of a model, resolved to decoded assets"""
+
+    def __init__(self, mesh: 'Mesh', material: 'Material', textures: Dict[str, 'Texture'], bone_map):
+        self.mesh = mesh
+        self.material = material
+        self.textures = textures  # material slot -> texture
+        self.bone_map = bone_map
+
+    def __repr__(self):
+        return '<SubMesh {} {} textures:{}>'.format(self.mesh, self.material, list(self.textures))
 
 
 class Bone:
@@ -513,7 +1069,7 @@ class Bone:
         return data
 
 
-class Model:
+class Model(Asset):
 
     def __init__(self, path: Path):
         self.path = path
@@ -523,116 +1079,196 @@ class Model:
         self.stream_offset = 0
         self.bone_count = 0
         self.bones = []  # type: List[Bone]
-        self.bone_map_list = []
+        self.bone_map_list = []  # type: List[np.ndarray]
         self.name_list = {}
 
-    def to_json(self):
+    def __repr__(self):
+        return '<Model "{}" bones:{}>'.format(self.name, self.bone_count)
+
+    def to_json(self, arrays=False):
+        """:param arrays: keep numpy arrays, for JsonStream's packed arrays"""
         data = {
             'name': self.name,
             'bones': [b.to_json() for b in self.bones],
-            'bone_map': self.bone_map_list,
+            'bone_map': [bone_map if arrays else bone_map.tolist() for bone_map in self.bone_map_list],
             'name_list': self.name_list,
             'mesh_data': self.model_data
         }
         return data
 
-    def read(self, reader: ByteIO):
-        items = reader.get_items()
-        for item in items:
-            reader.seek(item.offset)
-            if item.type == 20:
-                self.chunk_name = reader.read_ascii_string(reader.read_int32())
-            if item.type == 21:
-                self.name = reader.read_ascii_string(reader.read_int32())
-                # print('New model',self.name)
-            if item.type == 30:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 1:
-                        items3 = reader.get_items()
-                        for item3 in items3:
-                            reader.seek(item3.offset)
-                            flag = reader.read_fmt('BBBB')
-                            if flag == (103, 0, 65, 0):
-                                mesh_chunk = None
-                                mat_chunk = None
-                                items4 = reader.get_items()
-                                for item4 in items4:
-                                    reader.seek(item4.offset)
-
-                                    if item4.type == 31:
-                                        items5 = reader.get_items()
-                                        for item5 in items5:
-                                            reader.seek(item5.offset)
-                                            if item5.type == 20:
-                                                mesh_chunk = reader.read_ascii_string(reader.read_int32())
-                                    if item4.type == 33:
-                                        items5 = reader.get_items()
-                                        for item5 in items5:
-                                            reader.seek(item5.offset)
-                                            if item5.type == 20:
-                                                mat_chunk = reader.read_ascii_string(reader.read_int32())
-                                if mesh_chunk and mat_chunk:
-                                    self.model_data.append([mesh_chunk, mat_chunk])
-            if item.type == 33:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 20:
-                        tmp = reader.read_int32()
-                    if item2.type == 21:
-                        self.bone_count = reader.read_int32()
-                    if item2.type == 22:
-                        self.stream_offset = reader.tell()
-                reader.seek(self.stream_offset)
-                if self.bone_count:
-                    for m in range(self.bone_count):
-                        tm = reader.tell()
-                        bone = Bone()
-                        bone.name = reader.read_ascii_string(32)
-                        bone.matrix = reader.read_fmt('f' * 16)
-                        reader.skip(4 * 7)
-                        bone.skin_id = reader.read_int32()
-                        bone.parent = reader.read_int32()
-                        reader.skip(4 * 3)
-                        self.bones.append(bone)
-                        reader.seek(tm + 144)
-                        self.name_list[bone.skin_id] = bone.name
-            if item.type == 35:
-                items2 = reader.get_items()
-                for item2 in items2:
-                    reader.seek(item2.offset)
-                    if item2.type == 1:
-                        items3 = reader.get_items()
-                        for item3 in items3:
-                            reader.seek(item3.offset)
-                            flag = reader.read_fmt('BBBB')
-                            if flag == (160, 0, 65, 0):
-                                items4 = reader.get_items()
-                                count = 0
-                                stream_offset = 0
-                                for item4 in items4:
-                                    reader.seek(item4.offset)
-                                    if item4.type == 22:
-                                        count = reader.read_int32()
-                                    if item4.type == 23:
-                                        stream_offset = reader.tell()
-                                if count:
-                                    reader.seek(stream_offset)
-                                    self.bone_map_list.append([reader.read_int32() for _ in range(count)])
+    def _add_mesh_data(self, reader: ByteIO, record):
+        if record.get('mesh_chunk') and record.get('mat_chunk'):
+            self.model_data.append([record['mesh_chunk'], record['mat_chunk']])
+
+    def _read_bones(self, reader: ByteIO, _):
+        reader.seek(self.stream_offset)
+        if self.bone_count:
+            for entry in reader.read_array(BONE_ENTRY, self.bone_count):
+                bone = Bone()
+                bone.name = reader.decode_ascii_string(entry['name'].strip(b'\x00'))
+                bone.matrix = tuple(entry['matrix'].tolist())
+                bone.skin_id = int(entry['skin_id'])
+                bone.parent = int(entry['parent'])
+                self.bones.append(bone)
+                self.name_list[bone.skin_id] = bone.name
+
+    def _add_bone_map(self, reader: ByteIO, record):
+        count = record.get('count', 0)
+        if count:
+            reader.seek(record['stream_offset'])
+            self.bone_map_list.append(reader.read_array(np.int32, count))
+
+    FLAGS = {(75, 0, 65, 0)}
+    SCHEMA = compile_schema(Chunk({
+        **NAMES,
+        30: Chunk({
+            1: Chunk(each=Chunk(flag=(103, 0, 65, 0), record=True, then=_add_mesh_data, fields={
+                31: Chunk({20: Field('mesh_chunk', STRING)}),
+                33: Chunk({20: Field('mat_chunk', STRING)}),
+            })),
+        }),
+        33: Chunk({21: Field('bone_count', INT32), 22: Field('stream_offset', OFFSET)}, then=_read_bones),
+        35: Chunk({
+            1: Chunk(each=Chunk(flag=(160, 0, 65, 0), record=True, then=_add_bone_map, fields={
+                22: Field('count', INT32),
+                23: Field('stream_offset', OFFSET),
+            })),
+        }),
+    }))
+
+
+ASSET_KINDS = {
+    'texture': (Texture, 'textures'),
+    'mesh': (Mesh, 'meshes'),
+    'material': (Material, 'materials'),
+    'model': (Model, 'models'),
+    'animation': (Animation, 'animation'),
+    'audio': (Audio, 'audio'),
+}
+# asset flag -> kind, new asset classes only need FLAGS and a schema
+FLAG_KINDS = {flag: kind for kind, (asset_class, _) in ASSET_KINDS.items() for flag in asset_class.FLAGS}
+
+
+def asset_json(asset: Asset, arrays=False):
+    """to_json of an asset, meshes and models keep numpy arrays when arrays is set"""
+    return asset.to_json(arrays) if isinstance(asset, (Mesh, Model)) else asset.to_json()
+
+
+def extract(path, verbose=False, incremental=False, asset_filter: Optional[AssetFilter] = None,
+            prp_options: Optional[dict] = None):
+    """Read and save one archive, returns (path, seconds, status, error traceback or None)"""
+    start = time.perf_counter()
+    status = 'OK'
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            with PRP(path, **prp_options or {}) as prp:
+                if incremental:
+                    if prp.update(asset_filter) is None:
+                        status = 'SKIP'
+                else:
+                    prp.read(asset_filter=asset_filter)
+                    prp.save()
+    except Exception:
+        return path, time.perf_counter() - start, 'FAIL', traceback.format_exc()
+    return path, time.perf_counter() - start, status, None
+
+
+def find_archives(patterns: List[str]) -> List[Path]:
+    """Expand directories (every .prp inside) and glob patterns into archive paths"""
+    archives = []
+    for pattern in patterns:
+        if Path(pattern).is_dir():
+            archives.extend(sorted(Path(pattern).glob('*.prp')))
+        else:
+            archives.extend(Path(path) for path in sorted(glob.glob(pattern)))
+    return archives
+
+
+def batch_extract(archives: List[Path], workers=None, verbose=False, incremental=False,
+                  asset_filter: Optional[AssetFilter] = None, prp_options: Optional[dict] = None):
+    """
+    Extract archives on a process pool, a failing archive is reported and does not stop the others
+    :param prp_options: keyword arguments of PRP, texture_format, triangulate... Without texture_workers
+     the CPUs are split between the worker processes
+    """
+    workers = workers or os.cpu_count()
+    prp_options = dict(prp_options or {})
+    if prp_options.get('texture_workers') is None:
+        prp_options['texture_workers'] = max(1, os.cpu_count() // min(workers, max(1, len(archives))))
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract, path, verbose, incremental, asset_filter, prp_options): path
+                   for path in archives}
+        for future in as_completed(futures):
+            try:
+                path, seconds, status, error = future.result()
+            except Exception:
+                path, seconds, status, error = futures[future], 0.0, 'FAIL', traceback.format_exc()
+            print('{:<4} {:8.2f}s  {}'.format(status, seconds, path.name), flush=True)
+            if error:
+                print(error, file=sys.stderr)
+            results.append((path, seconds, status, error))
+    failed = sum(status == 'FAIL' for _, _, status, _ in results)
+    skipped = sum(status == 'SKIP' for _, _, status, _ in results)
+    print('{} archives, {} failed, {} unchanged, {:.2f}s'.format(len(results), failed, skipped,
+                                                                 time.perf_counter() - start))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract Overlord II .prp archives to dump/<archive name>')
+    parser.add_argument('paths', nargs='+', help='archive, directory of archives or glob pattern')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes, defaults to CPU count')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print the per asset log of every archive')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='skip unchanged archives and only decode changed assets, see dump/<name>/manifest.json')
+    parser.add_argument('--texture-workers', type=int, default=None,
+                        help='texture threads per archive, defaults to the CPU count divided by the workers')
+    parser.add_argument('--textures', choices=('tga', 'dds'), default='tga',
+                        help='decode textures to tga, or copy the compressed blocks into dds files')
+    parser.add_argument('--texture-store', metavar='DIR',
+                        help='save each distinct texture once to this folder, shared by all archives')
+    parser.add_argument('--triangulate', action='store_true',
+                        help='store triangle strips as triangle lists in model.json')
+    parser.add_argument('--optimize-meshes', action='store_true',
+                        help='weld vertices and reorder meshes for the vertex cache, reports ACMR with -v')
+    parser.add_argument('--compact-json', action='store_true',
+                        help='model.json without indentation, arrays packed as base64 typed buffers')
+    parser.add_argument('--mesh-sidecars', action='store_true',
+                        help='write mesh geometry to .npz files next to model.json, for the fast importer path')
+    parser.add_argument('--glb', action='store_true', help='also write the models as binary glTF (model.glb)')
+    parser.add_argument('--mip', type=int, default=0, help='mip level of the textures to export')
+    parser.add_argument('--max-texture-size', type=int, default=0, metavar='PIXELS',
+                        help='export smaller mip levels of larger textures, e.g. 256 for previews')
+    filters = parser.add_argument_group('filters', 'globs are case insensitive and can be repeated, '
+                                                   'excludes win over includes')
+    filters.add_argument('--kind', dest='kinds', action='append', choices=list(ASSET_KINDS),
+                         help='only extract assets of this kind')
+    filters.add_argument('--exclude-kind', dest='exclude_kinds', action='append', choices=list(ASSET_KINDS))
+    filters.add_argument('--chunk', dest='chunk_names', action='append', metavar='GLOB',
+                         help='only extract assets whose chunk name matches')
+    filters.add_argument('--exclude-chunk', dest='exclude_chunk_names', action='append', metavar='GLOB')
+    filters.add_argument('--name', dest='names', action='append', metavar='GLOB',
+                         help='only extract assets whose name matches, e.g. "*Minion*"')
+    filters.add_argument('--exclude-name', dest='exclude_names', action='append', metavar='GLOB')
+    args = parser.parse_args(argv)
+    archives = find_archives(args.paths)
+    if not archives:
+        parser.error('no archives found')
+    asset_filter = AssetFilter(args.kinds, args.exclude_kinds, args.chunk_names, args.exclude_chunk_names,
+                               args.names, args.exclude_names)
+    prp_options = {'texture_format': args.textures, 'mip_level': args.mip, 'max_texture_size': args.max_texture_size,
+                   'texture_store': args.texture_store, 'triangulate': args.triangulate,
+                   'optimize_meshes': args.optimize_meshes, 'export_glb': args.glb,
+                   'compact_json': args.compact_json, 'mesh_sidecars': args.mesh_sidecars,
+                   'texture_workers': args.texture_workers}
+    results = batch_extract(archives, args.workers, args.verbose, args.incremental, asset_filter or None,
+                            prp_options)
+    return 1 if any(status == 'FAIL' for _, _, status, _ in results) else 0
 
 
 if __name__ == '__main__':
-    # path = Path(r"E:\SteamLibrary\steamapps\common\Overlord II\Resources")
-    # for file in path.glob('Character*.prp'):
-    #     # a = PRP(r"D:\SteamLibrary\steamapps\common\Overlord II\Resources\Environment Empire Sewers.prp")
-    #     # a = PRP(r"D:\SteamLibrary\steamapps\common\Overlord II\Resources\Character Alpha Lizard.prp")
-    #     print('Extracting',file.stem)
-    #     a = PRP(file)
-    #     a.read()
-    #     a.save()
-    ...
-    a = PRP(r"E:\SteamLibrary\steamapps\common\Overlord II\Resources\Character Minion Master.prp")
-    a.read()
-    a.save()
+    sys.exit(main())
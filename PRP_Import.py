@@ -6,8 +6,12 @@ from typing import Dict, List
 
 import bpy
 import mathutils
+import numpy as np
 from mathutils import *
 
+from . import MeshTools
+from .JsonStream import array_hook
+
 
 def split(array, n=3):
     return [array[i:i + n] for i in range(0, len(array), n)]
@@ -39,16 +43,17 @@ def fix_matrix(matrix):
 
 
 class PRPIO:
-    def __init__(self, path: str = '', json_data={}, import_textures=False, join_bones=False):
+    def __init__(self, path: str = '', json_data={}, import_textures=False, join_bones=False, asset_filter=None):
         # TODO: make import_textures to do stuff
         self.import_textures = import_textures
         self.path = Path(path)
         self.name = self.path.stem
         self.join_bones = join_bones
+        self.asset_filter = asset_filter  # AssetFilter.AssetFilter, models/meshes/materials it rejects are skipped
         if json_data:
             self.model_json = json_data
         else:
-            self.model_json = json.load(self.path.open('r'))
+            self.model_json = json.load(self.path.open('r'), object_hook=array_hook)  # compact json packs arrays
 
         self.armature_obj = None
         self.armature = None
@@ -154,6 +159,11 @@ class PRPIO:
 
         return mat_ind
 
+    def match(self, kind, chunk_name, data):
+        if self.asset_filter is None:
+            return True
+        return self.asset_filter.match(kind, chunk_name, data.get('name', ''))
+
     def remap_materials(self, used_materials, all_materials):
         remap = {}
         for n, used_material in enumerate(used_materials):
@@ -161,28 +171,94 @@ class PRPIO:
 
         return remap
 
+    def mesh_arrays(self, mesh_json) -> Dict[str, np.ndarray]:
+        """Geometry of a mesh as numpy arrays, from its .npz sidecar (PRP mesh_sidecars) or from the json"""
+        if 'sidecar' in mesh_json:
+            with np.load(str(self.path.parent / mesh_json['sidecar'])) as sidecar:
+                return dict(sidecar)
+        vertices = mesh_json['vertices']
+        arrays = {name: np.asarray(data) for name, data in vertices.items() if name != 'weight'}
+        arrays['indices'] = np.asarray(mesh_json['indices'], np.int64)
+        arrays['weight_bone'] = np.asarray(vertices['weight']['bone'])
+        arrays['weight_weight'] = np.asarray(vertices['weight']['weight'])
+        return arrays
+
     @staticmethod
-    def strip_to_list(indices):
-        new_indices = []
-        for v in range(0, len(indices) - 2):
-            if v & 1:
-                new_indices.append(indices[v])
-                new_indices.append(indices[v + 1])
-                new_indices.append(indices[v + 2])
-            else:
-                new_indices.append(indices[v])
-                new_indices.append(indices[v + 2])
-                new_indices.append(indices[v + 1])
-        new_indices = list(filter(lambda a: len(set(a)) == 3, split(new_indices)))
-        return new_indices
+    def triangles(indices, triangulated):
+        if triangulated:  # converted to a triangle list by the extractor, see PRP(triangulate=True)
+            return indices[:len(indices) // 3 * 3].reshape(-1, 3)
+        return MeshTools.strip_to_list(indices)
+
+    @staticmethod
+    def fill_mesh(mesh, positions, triangles, uvs):
+        """Vertices, triangles and uvs through foreach_set, uvs are gathered per loop from the loop's vertex"""
+        loops = triangles.astype(np.int32).ravel()
+        mesh.vertices.add(len(positions))
+        mesh.vertices.foreach_set('co', positions.astype(np.float32).ravel())
+        mesh.loops.add(len(loops))
+        mesh.loops.foreach_set('vertex_index', loops)
+        mesh.polygons.add(len(triangles))
+        mesh.polygons.foreach_set('loop_start', np.arange(0, len(loops), 3, dtype=np.int32))
+        mesh.polygons.foreach_set('loop_total', np.full(len(triangles), 3, np.int32))
+        mesh.update(calc_edges=True)
+        mesh.uv_textures.new()
+        if len(uvs) and len(loops):
+            mesh.uv_layers[0].data.foreach_set('uv', uvs[loops, :2].astype(np.float32).ravel())
+
+    @staticmethod
+    def weight_buckets(bones, weights):
+        """
+        Vertex indices grouped by (bone, weight) for vertex group add calls, from (vertices, influences) bone
+        indices and 0-255 weights. Like per vertex REPLACE calls, the last influence of a vertex on a bone wins
+        """
+        bones = np.asarray(bones, np.int64)
+        if not bones.size:
+            return
+        vertices = np.repeat(np.arange(len(bones)), bones.shape[1])
+        bones = bones.ravel()
+        weights = np.rint(np.asarray(weights, np.float64)).astype(np.int64).ravel()
+        used = weights != 0
+        vertices, bones, weights = vertices[used], bones[used], weights[used]
+        _, last = np.unique((vertices * (bones.max(initial=0) + 1) + bones)[::-1], return_index=True)
+        keep = np.sort(len(vertices) - 1 - last)
+        vertices, bones, weights = vertices[keep], bones[keep], weights[keep]
+        keys = bones * 256 + weights
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        for start, end in zip(starts, np.append(starts[1:], len(keys))):
+            yield int(keys[start] // 256), int(keys[start] % 256), vertices[order[start:end]]
+
+    def assign_weights(self, weight_groups, arrays, bone_map, name_list):
+        """
+        A few add calls per vertex group. Only bone map slots of weighted influences are resolved to bone names,
+        once per mesh, zero weight influences may point anywhere
+        """
+        slots = np.asarray(arrays['weight_bone'], np.int64)
+        weights = np.rint(np.asarray(arrays['weight_weight'], np.float64)).astype(np.int64)
+        used = weights != 0
+        if not used.any():
+            return
+        slot_names = {slot: name_list[str(int(bone_map[slot]))] for slot in np.unique(slots[used]).tolist()}
+        names = sorted(set(slot_names.values()))
+        bone_of_slot = np.zeros(max(slot_names) + 1, np.int64)
+        for slot, name in slot_names.items():
+            bone_of_slot[slot] = names.index(name)
+        bones = bone_of_slot[np.where(used, slots, 0)]
+        for bone, weight, vertices in self.weight_buckets(bones, np.where(used, weights, 0)):
+            weight_groups[names[bone]].add(vertices.tolist(), weight / 255, 'REPLACE')
 
     def build_meshes(self, mesh_data):
 
         # base_name = mesh_data['name']
         for m, (mesh_id, mat_id) in enumerate(mesh_data['mesh_data']):
-            mesh_json = self.model_json['meshes'][mesh_id]
+            mesh_json = self.model_json['meshes'].get(mesh_id)
+            if mesh_json is None or not self.match('mesh', mesh_id, mesh_json):
+                continue
             # pprint(mesh_json)
-            mat_json = self.model_json['materials'][mat_id]
+            mat_json = self.model_json['materials'].get(mat_id)
+            if mat_json is not None and not self.match('material', mat_id, mat_json):
+                mat_json = None
             name = mesh_json['name']
             mesh_obj = bpy.data.objects.new(name, bpy.data.meshes.new(name))
             bpy.context.scene.objects.link(mesh_obj)
@@ -199,33 +275,18 @@ class PRPIO:
                 print('Bone list available, creating vertex groups')
                 weight_groups = {bone['name']: mesh_obj.vertex_groups.new(bone['name']) for bone in
                                  mesh_data['bones']}
-            uvs = mesh_json['vertices']['uv']
+            arrays = self.mesh_arrays(mesh_json)
             print('Building mesh:', name)
             print('Mesh mode:', mesh_json['mode'])
-            # new_indices = split(mesh_json['indices'])
-
-            new_indices = self.strip_to_list(mesh_json['indices'])
-            # if len(new_indices) % 3 != 0:
-            #     print('Indices:', len(new_indices) / 3)
-            #     print('Skipping')
-            #     continue
-            mesh.from_pydata(mesh_json['vertices']['pos'], [], new_indices)
-            mesh.update()
-            mesh.uv_textures.new()
-            uv_data = mesh.uv_layers[0].data
-            for i in range(len(uv_data)):
-                u = uvs[mesh.loops[i].vertex_index]
-                uv_data[i].uv = u
-            if mesh_data['bones']:
-                for n, (bones, weights) in enumerate(
-                        zip(mesh_json['vertices']['weight']['bone'], mesh_json['vertices']['weight']['weight'])):
-                    for bone, weight in zip(bones, weights):
-                        if weight != 0:
-                            # if bone in mesh_data['bone_map']:
-                            bone_id = mesh_data['bone_map'][m][bone]
-                            bone_name = mesh_data['name_list'][str(bone_id)]  # ['name']
-                            weight_groups[bone_name].add([n], weight / 255, 'REPLACE')
-            self.get_material(mat_json['name'], mesh_obj)
+            triangles = self.triangles(arrays['indices'], mesh_json.get('triangulated'))
+            self.fill_mesh(mesh, arrays['pos'].reshape(-1, 3), triangles, arrays['uv'].reshape(-1, 2))
+            if mesh_data['bones'] and arrays['weight_weight'].size:
+                if m < len(mesh_data['bone_map']):
+                    self.assign_weights(weight_groups, arrays, mesh_data['bone_map'][m], mesh_data['name_list'])
+                else:
+                    print('No bone map for', name, 'skipping weights')
+            if mat_json is not None:
+                self.get_material(mat_json['name'], mesh_obj)
             bpy.ops.object.select_all(action="DESELECT")
             mesh_obj.select = True
             bpy.context.scene.objects.active = mesh_obj
@@ -234,7 +295,9 @@ class PRPIO:
             mesh.use_auto_smooth = True
 
     def create_models(self):
-        for model in self.model_json['models'].values():
+        for chunk_name, model in self.model_json['models'].items():
+            if not self.match('model', chunk_name, model):
+                continue
             # pprint(model)
             if model['bones']:
                 self.create_skeleton(model['bones'], self.join_bones)
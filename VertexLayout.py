@@ -0,0 +1,77 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# vertex element type (d) -> (component format, component count)
+VERTEX_ELEMENT_TYPES = {
+    1: ('<f4', 2),
+    2: ('<f4', 3),
+    3: ('<f4', 4),
+    4: ('u1', 1),
+    7: ('u1', 1),
+    15: ('u1', 4),
+}
+# vertex element usage (c) -> attribute name, a usage index (a) above 0 is appended: uv1, uv2...
+# only codes confirmed by the game data are named, others are kept as usage<c>
+VERTEX_USAGES = {
+    1: 'pos',
+    5: 'uv',
+    10: 'skin_weight',
+    11: 'skin_ind',
+}
+
+
+class VertexLayout:
+    """
+    Vertex declaration compiled to attribute name -> (component format, component count, offset).
+    The size of an unknown element type is unknown and so are the offsets after it, only the elements before it
+    are compiled.
+    """
+    __slots__ = ('elements', 'attributes')
+
+    def __init__(self, elements: Tuple[Tuple[int, int, int, int], ...]):
+        self.elements = elements
+        self.attributes = {}  # type: Dict[str, Tuple[str, int, int]]
+        offset = 0
+        for usage_index, _, usage, element_type in elements:
+            if element_type not in VERTEX_ELEMENT_TYPES:
+                print('Unknown vertex element type {} (usage {}), skipping it and the elements after it'.format(
+                    element_type, usage))
+                break
+            fmt, count = VERTEX_ELEMENT_TYPES[element_type]
+            name = VERTEX_USAGES.get(usage, 'usage{}'.format(usage))
+            if usage_index:
+                name += str(usage_index)
+            while name in self.attributes:
+                name += '_'
+            self.attributes[name] = (fmt, count, offset)
+            offset += np.dtype(fmt).itemsize * count
+
+    def __repr__(self):
+        return '<VertexLayout {}>'.format(', '.join(self.attributes))
+
+    def __contains__(self, name):
+        return name in self.attributes
+
+    def offset(self, name: str) -> Optional[int]:
+        return self.attributes[name][2] if name in self.attributes else None
+
+    def dtype(self, names: Optional[Iterable[str]] = None) -> np.dtype:
+        """Structured dtype of the requested attributes (all by default) at their offsets in a vertex"""
+        names = [name for name in (self.attributes if names is None else names) if name in self.attributes]
+        formats = [(self.attributes[name][0], (self.attributes[name][1],)) for name in names]
+        offsets = [self.attributes[name][2] for name in names]
+        itemsize = max([offset + np.dtype(fmt).itemsize for fmt, offset in zip(formats, offsets)] + [1])
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize})
+
+
+_LAYOUTS = {}  # type: Dict[Tuple[Tuple[int, int, int, int], ...], VertexLayout]
+
+
+def compile_layout(elements: Iterable[Tuple[int, int, int, int]]) -> VertexLayout:
+    """Layout of a vertex declaration, meshes sharing a declaration share one layout"""
+    elements = tuple(tuple(element) for element in elements)
+    layout = _LAYOUTS.get(elements)
+    if layout is None:
+        layout = _LAYOUTS[elements] = VertexLayout(elements)
+    return layout
@@ -11,7 +11,9 @@ bl_info = {
     "category": "Import-Export"
 }
 
-from bpy.props import StringProperty, BoolProperty, CollectionProperty
+from bpy.props import StringProperty, BoolProperty, CollectionProperty, EnumProperty
+
+KIND_ITEMS = (('model', 'Models', ''), ('mesh', 'Meshes', ''), ('material', 'Materials', ''))
 
 
 class Overlord2_OT_operator(bpy.types.Operator):
@@ -27,12 +29,31 @@ class Overlord2_OT_operator(bpy.types.Operator):
     normal_bones = BoolProperty(name="Make normal skeleton?", default=False, subtype='UNSIGNED')
     join_clamped = BoolProperty(name="Join clamped meshes?", default=False, subtype='UNSIGNED')
     filter_glob = StringProperty(default="*.json", options={'HIDDEN'})
+    kinds = EnumProperty(name="Import", options={'ENUM_FLAG'}, items=KIND_ITEMS,
+                         default={'model', 'mesh', 'material'})
+    exclude_kinds = EnumProperty(name="Exclude", options={'ENUM_FLAG'}, items=KIND_ITEMS, default=set())
+    chunk_names = StringProperty(name="Chunk names", default="", description="Comma separated chunk name globs")
+    exclude_chunk_names = StringProperty(name="Exclude chunk names", default="",
+                                         description="Comma separated chunk name globs")
+    names = StringProperty(name="Names", default="", description="Comma separated name globs, e.g. *Minion*")
+    exclude_names = StringProperty(name="Exclude names", default="", description="Comma separated name globs")
 
     def execute(self, context):
         from . import PRP_Import
+        from .AssetFilter import AssetFilter
+        if not self.kinds - self.exclude_kinds:
+            # an empty include list would keep every kind
+            self.report({'WARNING'}, 'No asset kind selected, nothing to import')
+            return {'CANCELLED'}
+        split = lambda globs: [glob.strip() for glob in globs.split(',') if glob.strip()]
+        asset_filter = AssetFilter(kinds=self.kinds, exclude_kinds=self.exclude_kinds,
+                                   chunk_names=split(self.chunk_names),
+                                   exclude_chunk_names=split(self.exclude_chunk_names),
+                                   names=split(self.names), exclude_names=split(self.exclude_names))
         directory = Path(self.filepath).parent.absolute()
         for file in self.files:
-            importer = PRP_Import.PRPIO(str(directory / file.name), join_bones=self.normal_bones)
+            importer = PRP_Import.PRPIO(str(directory / file.name), join_bones=self.normal_bones,
+                                        asset_filter=asset_filter)
 
         return {'FINISHED'}
 
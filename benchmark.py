@@ -0,0 +1,114 @@
+import os
+import struct
+import tempfile
+import timeit
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from BCn import BCN_FORMATS, decode_bcn, decode_bcn_batch, level_size
+from ByteIO import ByteIO, DataChunk
+
+
+class LegacyByteIO(ByteIO):
+    """ByteIO with the original calcsize + read + unpack decoding, kept as a reference point"""
+
+    def read(self, t):
+        size = struct.calcsize(t)
+        return struct.unpack(t, self._read(size))[0]
+
+    def read_fmt(self, fmt):
+        size = struct.calcsize(fmt)
+        return struct.unpack(fmt, self._read(size))
+
+    def read_uint32(self):
+        return self.read('I')
+
+    def read_int32(self):
+        return self.read('i')
+
+    def read_uint8(self):
+        return self.read('B')
+
+    def get_list(self, obj_type: int) -> List['DataChunk']:
+        lst = []
+        if obj_type >= 128:
+            count_s = obj_type - 128
+            count_b = self.read_int32()
+            lst.extend([DataChunk(*self.read_fmt('BB'), self) for _ in range(count_s)])
+            lst.extend([DataChunk(*self.read_fmt('ii'), self) for _ in range(count_b)])
+        else:
+            lst.extend([DataChunk(*self.read_fmt('BB'), self) for _ in range(obj_type)])
+        pos = self.tell()
+        for item in lst:
+            item.offset += pos
+        return lst
+
+
+def _make_test_file(entries=20000):
+    data = bytearray()
+    data += struct.pack('=Bi', 128, entries)
+    data += b''.join(struct.pack('ii', n % 64, n * 4) for n in range(entries))
+    data += bytes(range(256)) * (entries * 4 // 256 + 1)
+    fd, path = tempfile.mkstemp(suffix='.bin')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path, entries
+
+
+def _throughput(reader, func, count, repeat=5):
+    def run():
+        reader.seek(0)
+        func()
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return count / best
+
+
+def bench_byteio():
+    path, entries = _make_test_file()
+    readers = [
+        ('legacy', LegacyByteIO(path=path)),
+        ('mmap+unpack_from', ByteIO(path=path, use_mmap=True)),
+    ]
+    cases = [
+        ('read_uint32', lambda r: (lambda: [r.read_uint32() for _ in range(entries)]), entries),
+        ("read_fmt('BBBB')", lambda r: (lambda: [r.read_fmt('BBBB') for _ in range(entries)]), entries),
+        ('get_items', lambda r: (lambda: [item.offset for item in r.get_items()]), entries),
+    ]
+    print('ByteIO throughput, {} entries'.format(entries))
+    for case_name, make, count in cases:
+        results = {name: _throughput(reader, make(reader), count) for name, reader in readers}
+        legacy = results['legacy']
+        for name, ops in results.items():
+            print('\t{:<18} {:<18} {:>14,.0f} ops/s  x{:.2f}'.format(case_name, name, ops, ops / legacy))
+    for _, reader in readers:
+        reader.close()
+    os.remove(path)
+
+
+def bench_bcn(size=512, batch=16, repeat=5):
+    rng = np.random.default_rng(0)
+    print('BCn decode, {0}x{0} textures'.format(size))
+    for texture_format, (pil_decoder, block_size, fourcc) in BCN_FORMATS.items():
+        data = rng.integers(0, 256, level_size(size, size, block_size), np.uint8).tobytes()
+        pil = np.asarray(Image.frombuffer('RGBA', (size, size), data, 'bcn', pil_decoder))
+        assert (decode_bcn(data, size, size, texture_format) == pil).all(), 'not bit exact against PIL'
+        images = [(data, size, size, texture_format)] * batch
+        results = {
+            'PIL': min(timeit.repeat(lambda: np.asarray(Image.frombuffer('RGBA', (size, size), data, 'bcn',
+                                                                        pil_decoder)),
+                                     number=1, repeat=repeat)),
+            'numpy': min(timeit.repeat(lambda: decode_bcn(data, size, size, texture_format),
+                                       number=1, repeat=repeat)),
+            'numpy batch': min(timeit.repeat(lambda: decode_bcn_batch(images), number=1, repeat=repeat)) / batch,
+        }
+        for name, seconds in results.items():
+            print('\t{:<18} {:<18} {:>10.2f} MPixel/s  x{:.2f}'.format(
+                fourcc.decode(), name, size * size / seconds / 1e6, results['PIL'] / seconds))
+
+
+if __name__ == '__main__':
+    bench_byteio()
+    bench_bcn()